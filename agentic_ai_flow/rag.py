@@ -3,10 +3,13 @@
 RAG (Retrieval-Augmented Generation) process for product data.
 vectorstore using ChromaDB and Sentence Transformers.
 This script performs the following steps:
-1. Load product data from a dataset *data/*.pkl.
+1. Load product data from a snapshot *data/*.arrow.
 2. Preprocess and clean the data.
 3. Generate embeddings using a Sentence Transformer model.
-4. Store embeddings in a ChromaDB vectorstore.
+4. Store embeddings in a ChromaDB vectorstore. Ingestion is incremental: each document's
+   id is a hash of its category and text, so a re-run only embeds documents that are
+   new, updates the metadata of ones that changed and deletes ones no longer in the
+   snapshot.
 5. (Optional) Visualize embeddings using t-SNE and Plotly.
 
 """
@@ -15,12 +18,12 @@ import os
 import re
 import math
 import json
+import hashlib
 from tqdm import tqdm
 import random
 from dotenv import load_dotenv
 from huggingface_hub import login
 import numpy as np
-import pickle
 from sentence_transformers import SentenceTransformer
 from datasets import load_dataset
 import chromadb
@@ -48,12 +51,13 @@ collection_name = "products"
 # Model for generating embeddings   maps sentences & paragraphs to a 384 dimensional dense
 # vector space and is ideal for tasks like semantic search.
 victorization_model_name = "sentence-transformers/all-MiniLM-L6-v2"
+BATCH_SIZE = 1000
 
 
 hf_token = os.environ["HF_TOKEN"]
 login(hf_token, add_to_git_credential=True)
 
-from items import Item
+from snapshots import load_items
 
 
 def description(item):
@@ -61,40 +65,101 @@ def description(item):
     return text.split("\n\nPrice is $")[0]
 
 
+def document_id(category, document, n):
+    """
+    A stable id for the n-th item in a category with this description: a hash of all
+    three, so an item keeps its id wherever it appears in the snapshot
+    """
+    key = f"{category}\n{n}\n{document}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def snapshot_entries(items):
+    """
+    id -> (document, metadata) with one entry per item
+    Items in a category that share a description are numbered in order of price, so
+    each keeps its own entry and the same price gets the same id whatever the order
+    of the snapshot
+    """
+    prices = {}
+    for item in items:
+        prices.setdefault((item.category, description(item)), []).append(item.price)
+    entries = {}
+    for (category, document), group in prices.items():
+        for n, price in enumerate(sorted(group)):
+            metadata = {"categoty": category, "price": price}
+            entries[document_id(category, document, n)] = (document, metadata)
+    return entries
+
+
+def stored_entries(collection):
+    """
+    id -> metadata of everything already in the collection, read a page at a time
+    """
+    stored = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=BATCH_SIZE, offset=offset)
+        stored.update(zip(page["ids"], page["metadatas"]))
+        if len(page["ids"]) < BATCH_SIZE:
+            return stored
+        offset += BATCH_SIZE
+
+
+def ingest(collection, model, items):
+    """
+    Bring the collection in line with the items, embedding only documents it doesn't
+    have yet; returns the number of ids added, updated and deleted
+    """
+    entries = snapshot_entries(items)
+    stored = stored_entries(collection)
+    added = [key for key in entries if key not in stored]
+    updated = [
+        key for key in entries if key in stored and stored[key] != entries[key][1]
+    ]
+    deleted = [key for key in stored if key not in entries]
+    unchanged = len(entries) - len(added) - len(updated)
+    logger.info(
+        f"{len(entries)} documents: {len(added)} to embed, {len(updated)} to update, "
+        f"{len(deleted)} to delete, {unchanged} unchanged"
+    )
+
+    for i in range(0, len(deleted), BATCH_SIZE):
+        collection.delete(ids=deleted[i : i + BATCH_SIZE])
+
+    for i in range(0, len(updated), BATCH_SIZE):
+        ids = updated[i : i + BATCH_SIZE]
+        collection.update(ids=ids, metadatas=[entries[key][1] for key in ids])
+
+    for i in tqdm(range(0, len(added), BATCH_SIZE)):
+        ids = added[i : i + BATCH_SIZE]
+        documents = [entries[key][0] for key in ids]
+        embeddings = model.encode(documents).astype(float).tolist()
+        collection.upsert(
+            ids=ids,
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=[entries[key][1] for key in ids],
+        )
+
+    return {"added": len(added), "updated": len(updated), "deleted": len(deleted)}
+
+
 def main():
     logger.info("Starting RAG process...")
     # # Load dataset
-    with open("data/train_lite.pkl", "rb") as f:
-        train = pickle.load(f)
+    train = load_items("data/train_lite.arrow", ["prompt", "category", "price"])
     logger.info(f"Loaded dataset with {len(train)} records.")
     logger.info(f"Preprocessing first item  {train[0].prompt}...")
 
     client = chromadb.PersistentClient(path=DB)
-
-    # check if collection exit and delete then create new
-    if collection_name in [col.name for col in client.list_collections()]:
-        client.delete_collection(collection_name)
-    collection = client.create_collection(name=collection_name)
+    collection = client.get_or_create_collection(name=collection_name)
     model = SentenceTransformer(victorization_model_name)
 
-    # Process and add items to vectorstore
-
-    NUMBER_OF_ITEMS = len(train)
-
-    for i in tqdm(range(0, NUMBER_OF_ITEMS, 1000)):
-        documents = [description(item) for item in train[i : i + 1000]]
-
-        embeddings = model.encode(documents).astype(float).tolist()
-        metadatas = [
-            {"categoty": item.category, "price": item.price}
-            for item in train[i : i + 1000]
-        ]
-        ids = [f"doc_{j}" for j in range(i, i + len(documents))]
-        collection.add(
-            ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas
-        )
+    # Only documents not already in the vectorstore are embedded
+    counts = ingest(collection, model, train)
 
-    logger.info(f"Finished adding {NUMBER_OF_ITEMS} items to vectorstore: {DB}")
+    logger.info(f"Finished syncing {len(train)} items to vectorstore: {DB} {counts}")
 
 
 if __name__ == "__main__":
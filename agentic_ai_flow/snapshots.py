@@ -0,0 +1,171 @@
+"""
+Versioned Arrow snapshots of curated Items, replacing the train_lite / test_lite pickles
+The files are uncompressed Arrow IPC, so they are memory-mapped on open and only the
+columns asked for are read. A hash of the contents is saved in the schema metadata, so
+anything keyed by the data can be checked without reading it. Nothing here imports the
+Item class or the tokenizer
+
+Convert an existing pickle with:
+python snapshots.py data/train_lite.pkl data/test_lite.pkl
+"""
+
+import os
+import sys
+import pickle
+import hashlib
+import pyarrow as pa
+
+FORMAT_VERSION = 1
+PREFIX = "Price is $"
+SCHEMA = pa.schema(
+    [
+        ("title", pa.large_string()),
+        ("price", pa.float64()),
+        ("category", pa.string()),
+        ("details", pa.large_string()),
+        ("prompt", pa.large_string()),
+        ("token_count", pa.int32()),
+    ],
+    metadata={"format_version": str(FORMAT_VERSION)},
+)
+
+
+class ItemRecord:
+    """
+    A curated Item read back from a snapshot, with only the columns that were loaded
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def test_prompt(self):
+        """
+        Return a prompt suitable for testing, with the actual price removed
+        """
+        return self.prompt.split(PREFIX)[0] + PREFIX
+
+    def __repr__(self):
+        return f"<{self.title} = ${self.price}>"
+
+
+def save_items(items, path):
+    """
+    Write Items (or anything with the same attributes) to an Arrow snapshot
+    """
+    columns = {
+        name: [getattr(item, name, None) for item in items] for name in SCHEMA.names
+    }
+    table = pa.Table.from_pydict(columns, schema=SCHEMA)
+    schema = SCHEMA.with_metadata(
+        {**SCHEMA.metadata, b"content_hash": table_hash(table).encode()}
+    )
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table.replace_schema_metadata(schema.metadata))
+
+
+def table_hash(table):
+    """
+    Hash of the schema and values of a table, taken over its Arrow buffers
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(table.schema.remove_metadata().serialize())
+    for column in table.columns:
+        for chunk in column.chunks:
+            for buffer in chunk.buffers():
+                if buffer is not None:
+                    digest.update(buffer)
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_hash(path):
+    """
+    The content hash saved in a snapshot's metadata, which only reads its footer
+    Snapshots written before it was saved, and pickles, are hashed from the whole file
+    """
+    path = snapshot_path(path)
+    if not path.endswith(".pkl"):
+        metadata = pa.ipc.open_file(pa.memory_map(path, "r")).schema.metadata or {}
+        if b"content_hash" in metadata:
+            return metadata[b"content_hash"].decode()
+    return file_hash(path)
+
+
+def open_table(path, columns=None):
+    """
+    Memory-map a snapshot and return it as an Arrow Table, optionally with just some columns
+    """
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    metadata = reader.schema.metadata or {}
+    version = int(metadata.get(b"format_version", b"0"))
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} is snapshot format {version}, this code reads format {FORMAT_VERSION}"
+        )
+    table = reader.read_all()
+    return table.select(columns) if columns else table
+
+
+def snapshot_path(path):
+    """
+    The snapshot itself, or the pickle of the same name if the snapshot hasn't been written yet
+    """
+    if not os.path.exists(path):
+        pickle_path = os.path.splitext(path)[0] + ".pkl"
+        if os.path.exists(pickle_path):
+            return pickle_path
+    return path
+
+
+def load_items(path, columns=None):
+    """
+    Load a snapshot as a list of ItemRecords, e.g. load_items(path, ["prompt", "price"])
+    Falls back to the pickle of the same name if the snapshot hasn't been written yet
+    """
+    path = snapshot_path(path)
+    if path.endswith(".pkl"):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    return [ItemRecord(**row) for row in open_table(path, columns).to_pylist()]
+
+
+def iter_batches(path, columns, batch_size=10_000):
+    """
+    Yield a snapshot as dicts of column -> list of up to batch_size values, so a
+    snapshot can be streamed through with bounded memory rather than loaded as Items
+    """
+    path = snapshot_path(path)
+    if path.endswith(".pkl"):
+        items = load_items(path)
+        for i in range(0, len(items), batch_size):
+            batch = items[i : i + batch_size]
+            yield {name: [getattr(item, name) for item in batch] for name in columns}
+        return
+    for batch in open_table(path, columns).to_batches(max_chunksize=batch_size):
+        yield batch.to_pydict()
+
+
+def iter_items(path, columns, batch_size=10_000):
+    """
+    Yield a snapshot's Items one at a time as ItemRecords, reading one batch at a time
+    """
+    for batch in iter_batches(path, columns, batch_size):
+        for values in zip(*(batch[name] for name in columns)):
+            yield ItemRecord(**dict(zip(columns, values)))
+
+
+if __name__ == "__main__":
+    for pickle_path in sys.argv[1:]:
+        with open(pickle_path, "rb") as file:
+            items = pickle.load(file)
+        path = os.path.splitext(pickle_path)[0] + ".arrow"
+        save_items(items, path)
+        print(f"Wrote {len(items):,} items to {path}")
@@ -0,0 +1,195 @@
+"""
+Evaluate a chat model with one batch job instead of one request per test item
+The test prompts are written as a batch-request JSONL file and submitted together; the
+job is polled until it finishes, and the replies are matched back to the items by index.
+The batch client is pluggable: OpenAIBatchClient uses OpenAI's Batch API, and
+LocalBatchClient answers the same requests with a local function, for offline tests
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import threading
+from exports import JsonlWriter
+
+ENDPOINT = "/v1/chat/completions"
+FINISHED = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_request(index, model, messages, **params):
+    return {
+        "custom_id": f"item-{index}",
+        "method": "POST",
+        "url": ENDPOINT,
+        "body": {"model": model, "messages": messages, **params},
+    }
+
+
+def write_batch(items, path, model, messages_for, **params):
+    """
+    Write one chat completion request per item, with the item's index as its custom_id
+    """
+    with JsonlWriter(path) as writer:
+        for index, item in enumerate(items):
+            request = batch_request(index, model, messages_for(item), **params)
+            writer.write(json.dumps(request) + "\n")
+    return path
+
+
+def read_replies(output):
+    """
+    A dict of item index -> reply from a batch output file; failed requests are left out
+    """
+    replies = {}
+    for line in output.splitlines():
+        if not line:
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") == 200:
+            index = int(result["custom_id"].split("-")[1])
+            replies[index] = response["body"]["choices"][0]["message"]["content"]
+    return replies
+
+
+class OpenAIBatchClient:
+    """
+    Submit batches to OpenAI's Batch API through an OpenAI client
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, path):
+        with open(path, "rb") as file:
+            uploaded = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h"
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        """
+        The status of the batch, and the id of its output file once it has one
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        return batch.status, batch.output_file_id
+
+    def download(self, file_id):
+        return self.client.files.content(file_id).text
+
+
+class LocalBatchClient:
+    """
+    A stand-in for a batch API: each request body is answered by respond(body), which
+    returns the reply text, in a background thread that goes through the same
+    in_progress and completed states as a real batch
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.jobs = {}
+        self.files = {}
+
+    def submit(self, path):
+        with open(path) as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        self.jobs[batch_id] = ("validating", None)
+        threading.Thread(
+            target=self.process, args=(batch_id, requests), daemon=True
+        ).start()
+        return batch_id
+
+    def process(self, batch_id, requests):
+        self.jobs[batch_id] = ("in_progress", None)
+        results = []
+        for request in requests:
+            result = {"custom_id": request["custom_id"]}
+            try:
+                reply = self.respond(request["body"])
+                message = {"role": "assistant", "content": reply}
+                result["response"] = {
+                    "status_code": 200,
+                    "body": {"choices": [{"index": 0, "message": message}]},
+                }
+                result["error"] = None
+            except Exception as error:
+                result["response"] = None
+                result["error"] = {"message": str(error)}
+            results.append(json.dumps(result) + "\n")
+        file_id = f"file_{uuid.uuid4().hex}"
+        self.files[file_id] = "".join(results)
+        self.jobs[batch_id] = ("completed", file_id)
+
+    def status(self, batch_id):
+        return self.jobs[batch_id]
+
+    def download(self, file_id):
+        return self.files[file_id]
+
+
+def wait_for(client, batch_id, poll_interval=5.0, max_interval=60.0, timeout=None):
+    """
+    Poll the batch, backing off exponentially up to max_interval, until it finishes
+    """
+    start = time.monotonic()
+    interval = poll_interval
+    while True:
+        status, output_file_id = client.status(batch_id)
+        if status in FINISHED:
+            return status, output_file_id
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {status} after {timeout}s")
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def batch_predictor(
+    client,
+    model,
+    messages_for,
+    parse,
+    work_dir="batches",
+    poll_interval=5.0,
+    timeout=None,
+    max_failure_rate=0.05,
+    **params,
+):
+    """
+    A predictor whose predict_batch prices all of Tester's items with one batch job
+    params are passed on in every request, e.g. seed=42, max_tokens=7; an item the batch
+    has no reply for is priced at NaN, which Tester leaves out of scoring, and the batch
+    is an error if more than max_failure_rate of its requests failed
+    """
+
+    def predict_batch(items):
+        os.makedirs(work_dir, exist_ok=True)
+        path = os.path.join(work_dir, f"batch-{int(time.time())}.jsonl")
+        write_batch(items, path, model, messages_for, **params)
+        batch_id = client.submit(path)
+        print(f"Submitted batch {batch_id} of {len(items):,} requests", flush=True)
+        status, output_file_id = wait_for(
+            client, batch_id, poll_interval, timeout=timeout
+        )
+        if status != "completed" or output_file_id is None:
+            raise RuntimeError(f"Batch {batch_id} finished as {status}")
+        replies = read_replies(client.download(output_file_id))
+        failed = len(items) - len(replies)
+        if failed > max_failure_rate * len(items):
+            raise RuntimeError(
+                f"{failed:,} of {len(items):,} requests in batch {batch_id} failed"
+            )
+        if failed:
+            print(f"{failed:,} requests failed and won't be scored", flush=True)
+        return [
+            parse(replies[i]) if i in replies else math.nan for i in range(len(items))
+        ]
+
+    def batch_pricer(item):
+        return predict_batch([item])[0]
+
+    batch_pricer.predict_batch = predict_batch
+    return batch_pricer
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark of the precompiled Scrubber against the original
+str.replace / per-character scrubbing, on the details strings of real Items
+Run from this folder after data_curation.py has written data/test_lite.pkl
+"""
+
+import pickle
+import re
+import timeit
+
+from items import Item, scrub_many
+
+REPEAT = 5
+
+
+def legacy_scrub_details(details):
+    for remove in Item.REMOVALS:
+        details = details.replace(remove, "")
+    return details
+
+
+def legacy_scrub(stuff):
+    stuff = re.sub(r'[:\[\]"{}【】\s]+', " ", stuff).strip()
+    stuff = stuff.replace(" ,", ",").replace(",,,", ",").replace(",,", ",")
+    words = stuff.split(" ")
+    select = [
+        word
+        for word in words
+        if len(word) < 7 or not any(char.isdigit() for char in word)
+    ]
+    return " ".join(select)
+
+
+def best_of(function):
+    return min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+if __name__ == "__main__":
+    with open("data/test_lite.pkl", "rb") as file:
+        sample = pickle.load(file)
+    details = [item.details for item in sample if item.details]
+    texts = [item.prompt for item in sample]
+
+    legacy_details = [legacy_scrub_details(d) for d in details]
+    assert legacy_details == [Item.scrubber.details(d) for d in details]
+    assert [legacy_scrub(d) for d in legacy_details] == scrub_many(legacy_details)
+    assert [legacy_scrub(t) for t in texts] == scrub_many(texts)
+
+    timings = [
+        (
+            "scrub (details)",
+            best_of(lambda: [legacy_scrub(d) for d in legacy_details]),
+            best_of(lambda: scrub_many(legacy_details)),
+        ),
+        (
+            "scrub (prompts)",
+            best_of(lambda: [legacy_scrub(t) for t in texts]),
+            best_of(lambda: scrub_many(texts)),
+        ),
+    ]
+    print(f"{len(details):,} details strings, {len(texts):,} prompts, best of {REPEAT}")
+    for name, before, after in timings:
+        print(
+            f"{name:<16} before {before*1000:8.1f} ms  after {after*1000:8.1f} ms  "
+            f"speedup {before/after:.1f}x"
+        )
@@ -0,0 +1,163 @@
+import os
+import json
+import sqlite3
+import hashlib
+from importlib.metadata import version
+from items import (
+    Item,
+    BASE_MODEL,
+    MIN_TOKENS,
+    MAX_TOKENS,
+    MIN_CHARS,
+    CEILING_CHARS,
+    CURATION_VERSION,
+)
+
+CACHE_PATH = "data/curation_cache.sqlite"
+LOOKUP_BATCH = 500  # stay well under SQLite's limit on query parameters
+
+caches = {}
+
+
+def config_hash():
+    """
+    Hash of everything that affects how a datapoint becomes an Item: the parameters,
+    CURATION_VERSION for the code itself, and the tokenizer library versions
+    The price range isn't included: it is checked before the cache, so changing it
+    doesn't invalidate anything
+    """
+    config = {
+        "version": CURATION_VERSION,
+        "transformers": version("transformers"),
+        "tokenizers": version("tokenizers"),
+        "base_model": BASE_MODEL,
+        "min_tokens": MIN_TOKENS,
+        "max_tokens": MAX_TOKENS,
+        "min_chars": MIN_CHARS,
+        "ceiling_chars": CEILING_CHARS,
+        "removals": Item.REMOVALS,
+        "question": Item.QUESTION,
+        "prefix": Item.PREFIX,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def datapoint_key(datapoint, price):
+    """
+    Content hash of the fields of a datapoint that curation reads
+    """
+    content = [
+        datapoint["title"],
+        datapoint["description"],
+        datapoint["features"],
+        datapoint["details"],
+        price,
+    ]
+    return hashlib.blake2b(json.dumps(content).encode(), digest_size=16).digest()
+
+
+def open_cache(path=CACHE_PATH):
+    """
+    Return the CurationCache for this path in this process, opening it on first use
+    """
+    key = (path, os.getpid())
+    cache = caches.get(key)
+    if cache is None:
+        cache = caches[key] = CurationCache(path)
+    return cache
+
+
+class CurationCache:
+    """
+    A persistent SQLite cache of curated Items, keyed by the content hash of the datapoint
+    and the hash of the curation config
+    Rejected datapoints are cached too, so a rerun with the same config only curates
+    datapoints that are new or have changed
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.config = config_hash()
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                key BLOB NOT NULL,
+                config TEXT NOT NULL,
+                include INTEGER NOT NULL,
+                title TEXT,
+                details TEXT,
+                prompt TEXT,
+                price REAL,
+                token_count INTEGER,
+                PRIMARY KEY (key, config)
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+
+    def get_many(self, keys):
+        """
+        Return a dict of key -> Item, or None for a datapoint that was rejected,
+        for each of the keys that are in the cache under the current config
+        """
+        found = {}
+        for i in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[i : i + LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                f"SELECT key, include, title, details, prompt, price, token_count "
+                f"FROM items WHERE config = ? AND key IN ({placeholders})",
+                [self.config, *batch],
+            )
+            for key, include, title, details, prompt, price, token_count in rows:
+                found[key] = None
+                if include:
+                    item = Item.__new__(Item)
+                    item.title = title
+                    item.details = details
+                    item.prompt = prompt
+                    item.price = price
+                    item.token_count = token_count
+                    item.include = True
+                    found[key] = item
+        return found
+
+    def put_many(self, keys, items):
+        """
+        Save the result of curating each datapoint, whether or not it was included
+        """
+        rows = []
+        for key, item in zip(keys, items):
+            if item.include:
+                rows.append(
+                    (
+                        key,
+                        self.config,
+                        1,
+                        item.title,
+                        item.details,
+                        item.prompt,
+                        item.price,
+                        item.token_count,
+                    )
+                )
+            else:
+                rows.append((key, self.config, 0, None, None, None, None, None))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def prune(self):
+        """
+        Delete the entries made under any other curation config
+        """
+        with self.connection:
+            deleted = self.connection.execute(
+                "DELETE FROM items WHERE config != ?", [self.config]
+            ).rowcount
+        self.connection.execute("VACUUM")
+        return deleted
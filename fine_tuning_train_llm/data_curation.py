@@ -2,17 +2,18 @@
 
 from items import Item
 import os
-import random
 from dotenv import load_dotenv
 from huggingface_hub import login
 from datasets import load_dataset, Dataset, DatasetDict
 import matplotlib.pyplot as plt
 from collections import Counter, defaultdict
 import numpy as np
-import pickle
 
-from loaders import ItemLoader
 from items import Item
+from stores import ItemStore, reservoir_sample
+from schedulers import CurationScheduler
+from snapshots import save_items
+from dedup import dedup_signed, dedup_stream, token_shards
 
 """
 Download file frome Hugging Face -> preprocess -> then export to pickel file
@@ -45,11 +46,15 @@ https://huggingface.co/datasets/McAuley-Lab/Amazon-Reviews-2023/tree/main/raw/me
 """
 
 
-def category_counter():
-    category_counts = Counter()
-    for item in items:
-        category_counts[item.category] += 1
+# Stream the datasets and reservoir-sample them on the fly instead of loading them whole.
+# Opt-in: the sample, and so the train/test split pushed to the Hub, differs from the
+# shuffle of the fully loaded datasets
+STREAMING = False
+SAMPLE_SIZE = 27_000
+NUM_SHARDS = 8
 
+
+def category_counter(category_counts):
     categories = category_counts.keys()
     counts = [category_counts[category] for category in categories]
 
@@ -70,6 +75,42 @@ def category_counter():
     plt.savefig("category_counter.png")
 
 
+def token_histogram(token_counts):
+    """
+    Plot the distribution of token counts from a Counter of token_count -> number of items
+    """
+    total = sum(token_counts.values())
+    average = sum(tokens * n for tokens, n in token_counts.items()) / total
+    plt.figure(figsize=(15, 6))
+    plt.title(
+        f"Token counts: Avg {average:,.1f} and highest {max(token_counts):,}\n"
+    )
+    plt.xlabel("Length (tokens)")
+    plt.ylabel("Count")
+    plt.hist(
+        list(token_counts.keys()),
+        weights=list(token_counts.values()),
+        rwidth=0.7,
+        color="skyblue",
+        bins=range(0, 300, 10),
+    )
+    plt.savefig("token_counts_histogram.png")
+
+
+def stream_items(dataset_names, token_counts, category_counts):
+    """
+    Yield chunks of curated Items with their MinHash signatures from every dataset,
+    streamed through one worker pool, tallying token and category counts as they pass
+    so nothing but the sample needs to be kept
+    """
+    scheduler = CurationScheduler(dataset_names)
+    for items, minhashes in scheduler.stream_chunks(sign=True):
+        for item in items:
+            token_counts[item.token_count] += 1
+            category_counts[item.category] += 1
+        yield items, minhashes
+
+
 def report(item):
     prompt = item.prompt
     tokens = Item.tokenizer.encode(item.prompt)
@@ -89,29 +130,33 @@ if __name__ == "__main__":
         "Appliances",
         # "Musical_Instruments",
     ]
-    items = []
-    for dataset_name in dataset_names:
-        loader = ItemLoader(dataset_name)
-        items.extend(loader.load())
-
-    tokens = [item.token_count for item in items]
-    plt.figure(figsize=(15, 6))
-    plt.title(
-        f"Token counts: Avg {sum(tokens) / len(tokens):,.1f} and highest {max(tokens):,}\n"
-    )
-    plt.xlabel("Length (tokens)")
-    plt.ylabel("Count")
-    plt.hist(tokens, rwidth=0.7, color="skyblue", bins=range(0, 300, 10))
-    # complete the code to save the figure to a file called token_counts_histogram.png
-    plt.savefig("token_counts_histogram.png")
-
-    sample = items
-    report(sample[50])
-
-    random.seed(42)
-    random.shuffle(sample)
-    train = sample[:25_000]
-    test = sample[25_000:27_000]
+    if STREAMING:
+        # Reservoir-sample the train and test split on the fly, holding at most SAMPLE_SIZE items
+        token_counts, category_counts = Counter(), Counter()
+        sample = reservoir_sample(
+            dedup_signed(stream_items(dataset_names, token_counts, category_counts)),
+            SAMPLE_SIZE,
+            seed=42,
+        )
+        token_histogram(token_counts)
+        report(sample[0])
+        train = sample[:25_000]
+        test = sample[25_000:SAMPLE_SIZE]
+    else:
+        # One worker pool curates every category, interleaving their chunks
+        store = CurationScheduler(dataset_names).load(store=ItemStore())
+
+        tokens = store.token_counts
+        values, counts = np.unique(tokens, return_counts=True)
+        token_histogram(Counter(dict(zip(values.tolist(), counts.tolist()))))
+
+        report(store[50])
+
+        # Same permutation as random.shuffle on the list of items, without building that list
+        kept = [view.index for view in dedup_stream(store)]
+        indices = store.shuffled_indices(seed=42, indices=kept)
+        train = store.items(indices[:25_000])
+        test = store.items(indices[25_000:SAMPLE_SIZE])
     print(
         f"Divided into a training set of {len(train):,} items and test set of {len(test):,} items"
     )
@@ -133,10 +178,12 @@ if __name__ == "__main__":
     DATASET_NAME = "ktomiwacloudai/lite-data"
     dataset.push_to_hub(DATASET_NAME, private=True)
 
-    # Let's pickle the training and test dataset so we don't have to execute all this code next time!
+    # Let's snapshot the training and test dataset so we don't have to execute all this code next time!
 
-    with open("data/train_lite.pkl", "wb") as file:
-        pickle.dump(train, file)
+    save_items(train, "data/train_lite.arrow")
+    save_items(test, "data/test_lite.arrow")
 
-    with open("data/test_lite.pkl", "wb") as file:
-        pickle.dump(test, file)
+    # And shards of the training set grouped by token count, for batching with little padding
+    os.makedirs("data/train_shards", exist_ok=True)
+    for i, shard in enumerate(token_shards(train, NUM_SHARDS)):
+        save_items(shard, f"data/train_shards/shard-{i:02d}.arrow")
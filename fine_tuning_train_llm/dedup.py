@@ -0,0 +1,258 @@
+"""
+Near-duplicate removal and token-length sharding for curated Items
+Amazon lists many variants of the same product with near-identical titles and descriptions.
+Each Item's text is reduced to a MinHash signature over word shingles, and locality-sensitive
+hashing on bands of the signature finds candidate duplicates without comparing every pair.
+The index holds about 1 KB per kept Item (see Deduper): compact enough for corpora of
+millions of Items, though it still grows with the number kept
+"""
+
+import zlib
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands of 8 rows: pairs above ~0.7 similarity become candidates
+SHINGLE = 3
+THRESHOLD = 0.8  # estimated Jaccard similarity above which a candidate is a duplicate
+SEED = 42
+CHUNK_SIZE = 2000
+
+rng = np.random.default_rng(SEED)
+A = rng.integers(1, 2**64 - 1, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+B = rng.integers(0, 2**64 - 1, size=NUM_PERM, dtype=np.uint64)
+ROWS = rng.integers(1, 2**64 - 1, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+SALTS = rng.integers(1, 2**64 - 1, size=NUM_PERM, dtype=np.uint64)
+
+
+def text_for(item):
+    """
+    The scrubbed product text of an Item, without the question and the price
+    """
+    return item.prompt.split("\n\n")[1]
+
+
+def signature(text):
+    """
+    MinHash signature of the word shingles of a text
+    Shingles are hashed with crc32 rather than hash(), which is salted per process
+    """
+    words = text.lower().split()
+    shingles = {
+        zlib.crc32(" ".join(words[i : i + SHINGLE]).encode())
+        for i in range(max(1, len(words) - SHINGLE + 1))
+    }
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    # Multiply-shift hashing with odd 64-bit a: the high 32 bits of a*h+b (mod 2**64)
+    permuted = (A[:, None] * hashes[None, :] + B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def signatures(texts):
+    return np.stack([signature(text) for text in texts])
+
+
+def band_hashes(minhashes, bands):
+    """
+    A 64-bit hash of each band of each signature, never 0, which marks an empty slot
+    Each band's rows are combined with random odd multipliers, salted per band and then
+    mixed as in splitmix64, so the low bits are good enough to pick a slot with
+    """
+    rows = minhashes.reshape(len(minhashes), bands, -1).astype(np.uint64)
+    hashes = (rows * ROWS[: rows.shape[2]]).sum(axis=2, dtype=np.uint64)
+    hashes += SALTS[:bands]
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    return hashes | np.uint64(1)
+
+
+class BandTable:
+    """
+    Open-addressing hash table from band hash to the index of the first kept signature
+    in that bucket, held in two numpy arrays: 12 bytes a slot, at most half full
+    Lookups and inserts take a whole array of keys and probe them together
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.values = np.zeros(capacity, dtype=np.uint32)
+        self.size = 0
+
+    def get_many(self, keys):
+        """
+        The value of each key, or -1 where it isn't in the table
+        """
+        mask = np.uint64(len(self.keys) - 1)
+        slots = keys & mask
+        found = np.full(len(keys), -1, dtype=np.int64)
+        active = np.arange(len(keys))
+        while len(active):
+            stored = self.keys[slots[active]]
+            hit = stored == keys[active]
+            found[active[hit]] = self.values[slots[active[hit]]]
+            active = active[~hit & (stored != 0)]
+            slots[active] = (slots[active] + np.uint64(1)) & mask
+        return found
+
+    def insert_many(self, keys, values):
+        """
+        Add keys that aren't in the table yet, and are distinct, with their values
+        """
+        while 2 * (self.size + len(keys)) > len(self.keys):
+            self.grow()
+        mask = np.uint64(len(self.keys) - 1)
+        slots = keys & mask
+        pending = np.arange(len(keys))
+        while len(pending):
+            free = pending[self.keys[slots[pending]] == 0]
+            taken, first = np.unique(slots[free], return_index=True)
+            winners = free[first]
+            self.keys[taken] = keys[winners]
+            self.values[taken] = values[winners]
+            pending = np.setdiff1d(pending, winners, assume_unique=True)
+            slots[pending] = (slots[pending] + np.uint64(1)) & mask
+        self.size += len(keys)
+
+    def grow(self):
+        filled = self.keys != 0
+        keys, values = self.keys[filled], self.values[filled]
+        self.keys = np.zeros(2 * len(self.keys), dtype=np.uint64)
+        self.values = np.zeros(len(self.keys), dtype=np.uint32)
+        self.size = 0
+        self.insert_many(keys, values)
+
+
+class Deduper:
+    """
+    An LSH index of the signatures kept so far
+    Items are checked in order and the first of each group of near-duplicates is kept
+    Each kept Item costs its signature, NUM_PERM * 4 = 512 bytes in one growing array,
+    and an entry per band in the BandTable, 12 bytes a slot in a table a quarter to half
+    full: 384-768 bytes for 16 bands. About 1 KB an Item in all, so ~5 GB for 5M Items,
+    and up to twice that just after the arrays have doubled
+    """
+
+    def __init__(self, threshold=THRESHOLD, bands=BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.table = BandTable()
+        self.kept = np.empty((1024, NUM_PERM), dtype=np.uint32)
+        self.count = 0
+        self.dropped = 0
+
+    def add_many(self, minhashes):
+        """
+        Index the signatures that aren't near-duplicates of one kept, in order, and
+        return whether each was kept
+        The table is looked up for the whole chunk at once; buckets first filled within
+        the chunk are tracked in a dict until the chunk's new keys are inserted together
+        """
+        keys = band_hashes(minhashes, self.bands)
+        found = self.table.get_many(keys.ravel()).reshape(keys.shape).tolist()
+        chunk_buckets = {}
+        kept = []
+        for minhash, row_keys, row_found in zip(minhashes, keys.tolist(), found):
+            candidates = {index for index in row_found if index >= 0}
+            candidates.update(
+                chunk_buckets[key] for key in row_keys if key in chunk_buckets
+            )
+            if any(
+                np.mean(self.kept[candidate] == minhash) >= self.threshold
+                for candidate in candidates
+            ):
+                self.dropped += 1
+                kept.append(False)
+                continue
+            if self.count == len(self.kept):
+                self.kept = np.concatenate([self.kept, np.empty_like(self.kept)])
+            self.kept[self.count] = minhash
+            for key, index in zip(row_keys, row_found):
+                if index < 0:
+                    chunk_buckets.setdefault(key, self.count)
+            self.count += 1
+            kept.append(True)
+        if chunk_buckets:
+            self.table.insert_many(
+                np.fromiter(chunk_buckets, dtype=np.uint64, count=len(chunk_buckets)),
+                np.fromiter(
+                    chunk_buckets.values(), dtype=np.uint32, count=len(chunk_buckets)
+                ),
+            )
+        return kept
+
+    def add(self, minhash):
+        """
+        Return True and index the signature if it isn't a near-duplicate of one kept
+        """
+        return self.add_many(minhash[None, :])[0]
+
+
+def dedup_signed(chunks, deduper=None):
+    """
+    Yield the Items that aren't near-duplicates of an earlier one, from chunks of
+    (items, signatures) whose signatures were computed already, e.g. by the curation
+    workers; the LSH lookups are cheap and run here
+    """
+    deduper = deduper or Deduper()
+    for chunk, chunk_signatures in chunks:
+        if len(chunk):
+            for item, kept in zip(chunk, deduper.add_many(chunk_signatures)):
+                if kept:
+                    yield item
+    print(f"Dedup dropped {deduper.dropped:,} near-duplicate items", flush=True)
+
+
+def dedup_stream(items, workers=None, chunk_size=CHUNK_SIZE, deduper=None):
+    """
+    Yield the Items that aren't near-duplicates of an earlier one
+    Signatures are computed in parallel a chunk at a time, with one chunk in flight
+    ahead of the one being filtered
+    workers defaults to one per core available, leaving one for the parent; don't run
+    this alongside another pool, but have that pool's workers sign the Items they make
+    and pass them to dedup_signed
+    """
+    from schedulers import default_workers
+
+    workers = workers or default_workers()
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def submit():
+            chunk = list(islice(items, chunk_size))
+            texts = [text_for(item) for item in chunk]
+            step = -(-len(texts) // workers) or 1
+            parts = [texts[i : i + step] for i in range(0, len(texts), step)]
+            return chunk, [pool.submit(signatures, part) for part in parts]
+
+        def signed():
+            chunk, futures = submit()
+            while chunk:
+                next_chunk, next_futures = submit()
+                yield chunk, np.concatenate([future.result() for future in futures])
+                chunk, futures = next_chunk, next_futures
+
+        yield from dedup_signed(signed(), deduper)
+
+
+def token_shards(items, num_shards):
+    """
+    Sort Items by token_count and cut them into num_shards shards of about the same
+    total number of tokens, so each shard batches with little padding
+    """
+    ordered = sorted(items, key=lambda item: item.token_count)
+    total = sum(item.token_count for item in ordered)
+    shards, shard, tokens = [], [], 0
+    for item in ordered:
+        shard.append(item)
+        tokens += item.token_count
+        boundary = total * (len(shards) + 1) / num_shards
+        if tokens >= boundary and len(shards) < num_shards - 1:
+            shards.append(shard)
+            shard = []
+    if shard:
+        shards.append(shard)
+    return shards
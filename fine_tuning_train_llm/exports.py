@@ -0,0 +1,162 @@
+"""
+Streaming export of fine-tuning examples as chat-format JSONL
+Records are written one line at a time from any iterable of Items, so the export runs in
+constant memory however many examples there are. Each record's token count is checked
+against the model's context limit, and the output can be gzip-compressed and split into
+shards of a maximum size
+
+python exports.py data/train_lite.arrow fine_tune_train.jsonl [--gzip] [--shard-mb N]
+"""
+
+import os
+import sys
+import gzip
+import json
+import tiktoken
+from snapshots import iter_items
+
+MODEL = "gpt-4o-mini-2024-07-18"
+MAX_TOKENS = 65_536  # the longest training example OpenAI accepts for gpt-4o-mini
+TOKENS_PER_MESSAGE = 3  # role and separators the chat format adds to each message
+TOKENS_PER_RECORD = 3  # the reply priming that ends every example
+
+SYSTEM_MESSAGE = (
+    "You estimate prices of items. Reply only with the price, no explanation"
+)
+QUESTION_SUFFIX = " to the nearest dollar"
+ANSWER_PREFIX = "\n\nPrice is $"
+
+
+def user_prompt(item):
+    """
+    The item's test prompt, without the price prefix or the nearest dollar instruction
+    """
+    return item.test_prompt().replace(QUESTION_SUFFIX, "").replace(ANSWER_PREFIX, "")
+
+
+def messages_for(item):
+    """
+    The chat a model is fine-tuned on: the question, then the answer with the price
+    """
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": user_prompt(item)},
+        {"role": "assistant", "content": f"Price is ${item.price:.2f}"},
+    ]
+
+
+def encoding_for(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(encoding, messages):
+    """
+    Tokens an example takes up in the model's context, counted as OpenAI's cookbook does
+    """
+    tokens = TOKENS_PER_RECORD
+    for message in messages:
+        tokens += TOKENS_PER_MESSAGE + len(encoding.encode(message["content"]))
+    return tokens
+
+
+class JsonlWriter:
+    """
+    Write lines to path, or to numbered shards path-00000.jsonl, path-00001.jsonl, ...
+    of at most shard_bytes uncompressed bytes each, optionally gzip-compressed
+    OpenAI uploads must be uncompressed JSONL; gzip is for keeping large exports
+    """
+
+    def __init__(self, path, compress=False, shard_bytes=None):
+        self.path = path
+        self.compress = compress
+        self.shard_bytes = shard_bytes
+        self.paths = []
+        self.file = None
+        self.size = 0
+
+    def shard_path(self):
+        path = self.path
+        if self.shard_bytes:
+            stem, extension = os.path.splitext(path)
+            path = f"{stem}-{len(self.paths):05d}{extension}"
+        return path + ".gz" if self.compress else path
+
+    def open(self):
+        self.close()
+        path = self.shard_path()
+        self.file = gzip.open(path, "wb") if self.compress else open(path, "wb")
+        self.paths.append(path)
+        self.size = 0
+
+    def write(self, line):
+        data = line.encode("utf-8")
+        if self.shard_bytes and self.size and self.size + len(data) > self.shard_bytes:
+            self.open()
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_jsonl(
+    items,
+    path,
+    messages_for=messages_for,
+    model=MODEL,
+    max_tokens=MAX_TOKENS,
+    compress=False,
+    shard_bytes=None,
+):
+    """
+    Write one {"messages": [...]} line per item, skipping any that exceed max_tokens,
+    and return a summary of what was written
+    """
+    encoding = encoding_for(model)
+    written, skipped, tokens = 0, 0, 0
+    with JsonlWriter(path, compress, shard_bytes) as writer:
+        for item in items:
+            messages = messages_for(item)
+            count = count_tokens(encoding, messages)
+            if count > max_tokens:
+                skipped += 1
+                continue
+            writer.write(json.dumps({"messages": messages}) + "\n")
+            written += 1
+            tokens += count
+    print(
+        f"Wrote {written:,} examples ({tokens:,} tokens) to {len(writer.paths)} "
+        f"file(s), skipped {skipped:,} over {max_tokens:,} tokens",
+        flush=True,
+    )
+    return {
+        "paths": writer.paths,
+        "written": written,
+        "skipped": skipped,
+        "tokens": tokens,
+    }
+
+
+if __name__ == "__main__":
+    snapshot, output = sys.argv[1:3]
+    shard_bytes = None
+    if "--shard-mb" in sys.argv:
+        shard_bytes = int(float(sys.argv[sys.argv.index("--shard-mb") + 1]) * 2**20)
+    write_jsonl(
+        iter_items(snapshot, ["title", "price", "prompt"]),
+        output,
+        compress="--gzip" in sys.argv,
+        shard_bytes=shard_bytes,
+    )
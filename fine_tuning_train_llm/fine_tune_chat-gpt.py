@@ -1,19 +1,21 @@
 import os
 import re
 import math
-import json
 import random
 from dotenv import load_dotenv
 from huggingface_hub import login
-from items import Item
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
 from collections import Counter
 from openai import OpenAI
 from anthropic import Anthropic
 
 from testing import Tester
+from snapshots import load_items
+from exports import write_jsonl
+from batches import OpenAIBatchClient, batch_predictor
+from fine_tunes import FineTuneJob
+from responses import CachedOpenAI
 
 path_env = "/Users/kehindetomiwa/Documents/Certifications/llm_udemy_ligency_team/ai-eng-playground/.env"
 load_dotenv(path_env, override=True)
@@ -24,78 +26,36 @@ os.environ["ANTHROPIC_API_KEY"] = os.getenv(
 os.environ["HF_TOKEN"] = os.getenv("HF_TOKEN", "your-key-if-not-using-env")
 
 
-openai = OpenAI()
+# Seeded calls are cached on disk, so re-running an evaluation doesn't pay for them again
+openai = CachedOpenAI(OpenAI())
 
-with open("data/train_lite.pkl", "rb") as file:
-    train = pickle.load(file)
-
-with open("data/test_lite.pkl", "rb") as file:
-    test = pickle.load(file)
+train = load_items("data/train_lite.arrow", ["title", "price", "prompt"])
+test = load_items("data/test_lite.arrow", ["title", "price", "prompt"])
 
 fine_tune_train = train[:500]
 fine_tune_validation = train[500:550]
 
 
-def messages_for(item):
-    system_message = (
-        "You estimate prices of items. Reply only with the price, no explanation"
-    )
-    user_prompt = (
-        item.test_prompt()
-        .replace(" to the nearest dollar", "")
-        .replace("\n\nPrice is $", "")
-    )
-    return [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": user_prompt},
-        {"role": "assistant", "content": f"Price is ${item.price:.2f}"},
-    ]
-
-
-def make_jsonl(items):
-    result = ""
-    for item in items:
-        messages = messages_for(item)
-        messages_str = json.dumps(messages)
-        result += '{"messages": ' + messages_str + "}\n"
-    return result.strip()
-
-
-def write_jsonl(items, filename):
-    with open(filename, "w") as f:
-        jsonl = make_jsonl(items)
-        f.write(jsonl)
-
-
+# Examples are streamed a line at a time, skipping any over the context limit
 write_jsonl(fine_tune_train, "fine_tune_train.jsonl")
 write_jsonl(fine_tune_validation, "fine_tune_validation.jsonl")
 
-with open("fine_tune_train.jsonl", "rb") as f:
-    train_file = openai.files.create(file=f, purpose="fine-tune")
-
-with open("fine_tune_validation.jsonl", "rb") as f:
-    validation_file = openai.files.create(file=f, purpose="fine-tune")
-
 wandb_integration = {"type": "wandb", "wandb": {"project": "gpt-pricer"}}
 
 
-openai.fine_tuning.jobs.create(
-    training_file=train_file.id,
-    validation_file=validation_file.id,
+# Uploads, the job id and the events seen so far are saved in fine_tune_state.json, so
+# re-running the script resumes the same job instead of starting another one
+fine_tune = FineTuneJob(
+    openai,
+    "fine_tune_train.jsonl",
+    "fine_tune_validation.jsonl",
     model="gpt-4o-mini-2024-07-18",
     seed=42,
     hyperparameters={"n_epochs": 1},
     integrations=[wandb_integration],
     suffix="pricer",
 )
-
-openai.fine_tuning.jobs.list(limit=1)
-job_id = openai.fine_tuning.jobs.list(limit=1).data[0].id
-
-openai.fine_tuning.jobs.retrieve(job_id)
-openai.fine_tuning.jobs.list_events(fine_tuning_job_id=job_id, limit=10).data
-
-fine_tuned_model_name = openai.fine_tuning.jobs.retrieve(job_id).fine_tuned_model
+fine_tuned_model_name = fine_tune.run()
 
 
 # The prompt
@@ -134,4 +94,20 @@ def gpt_fine_tuned(item):
     return get_price(reply)
 
 
-Tester.test(gpt_fine_tuned, test)
+# BATCH evaluates with one Batch API job instead, which is slower but half the price
+BATCH = False
+
+if BATCH:
+    gpt_fine_tuned_batch = batch_predictor(
+        OpenAIBatchClient(openai),
+        fine_tuned_model_name,
+        messages_for,
+        get_price,
+        seed=42,
+        max_tokens=7,
+    )
+    Tester.test(gpt_fine_tuned_batch, test, title="GPT Fine Tuned Batch")
+else:
+    # Each call is a network round trip, so run them concurrently with retries on API errors
+    Tester.test(gpt_fine_tuned, test, concurrency=16, rate_limit=50, retries=3)
+    print(openai.cache)
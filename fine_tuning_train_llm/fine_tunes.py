@@ -0,0 +1,253 @@
+"""
+Run an OpenAI fine-tuning job from the training files to the fine-tuned model name
+The train and validation files are uploaded concurrently, the job is tracked by its own
+id, and it is polled with exponential backoff while its new events are printed as they
+arrive. Progress is saved to a state file after every step, so a restarted script picks
+up the same files and job rather than uploading and training again.
+FakeFineTuningClient stands in for the OpenAI client in offline tests
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+STATE_PATH = "fine_tune_state.json"
+FINISHED = {"succeeded", "failed", "cancelled"}
+EVENTS_PAGE_SIZE = 100
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FineTuneJob:
+    """
+    One fine-tuning run: FineTuneJob(client, train_path, validation_path, **job_params)
+    then run() returns the fine-tuned model name once the job has succeeded
+    job_params are passed to fine_tuning.jobs.create, e.g. model, seed, hyperparameters
+    """
+
+    def __init__(
+        self,
+        client,
+        train_path,
+        validation_path,
+        state_path=STATE_PATH,
+        poll_interval=10.0,
+        max_interval=120.0,
+        **job_params,
+    ):
+        self.client = client
+        self.train_path = train_path
+        self.validation_path = validation_path
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.job_params = job_params
+        self.state = self.load_state()
+
+    def fingerprint(self):
+        """
+        Hash of the training files and job parameters; a saved state is only resumed
+        if it was made for the same ones
+        """
+        inputs = [
+            file_hash(self.train_path),
+            file_hash(self.validation_path),
+            self.job_params,
+        ]
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def load_state(self):
+        fingerprint = self.fingerprint()
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as file:
+                state = json.load(file)
+            if state.get("fingerprint") == fingerprint:
+                return state
+        return {"fingerprint": fingerprint}
+
+    def save_state(self):
+        partial = f"{self.state_path}.partial"
+        with open(partial, "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(partial, self.state_path)
+
+    async def upload(self, key, path):
+        if key not in self.state:
+            with open(path, "rb") as file:
+                uploaded = await asyncio.to_thread(
+                    self.client.files.create, file=file, purpose="fine-tune"
+                )
+            self.state[key] = uploaded.id
+            self.save_state()
+            print(f"Uploaded {path} as {uploaded.id}", flush=True)
+
+    async def create(self):
+        if "job_id" not in self.state:
+            job = await asyncio.to_thread(
+                self.client.fine_tuning.jobs.create,
+                training_file=self.state["train_file"],
+                validation_file=self.state["validation_file"],
+                **self.job_params,
+            )
+            self.state["job_id"] = job.id
+            self.save_state()
+            print(f"Created fine-tuning job {job.id}", flush=True)
+
+    async def new_events(self):
+        """
+        The job's events since the last one printed, oldest first
+        Events are listed newest first, so pages are read until the last one seen
+        """
+        seen = self.state.get("last_event_id")
+        events, after = [], None
+        while True:
+            page = await asyncio.to_thread(
+                self.client.fine_tuning.jobs.list_events,
+                fine_tuning_job_id=self.state["job_id"],
+                limit=EVENTS_PAGE_SIZE,
+                **({"after": after} if after else {}),
+            )
+            for event in page.data:
+                if event.id == seen:
+                    return events[::-1]
+                events.append(event)
+            if not page.has_more or not page.data:
+                return events[::-1]
+            after = page.data[-1].id
+
+    async def wait(self):
+        """
+        Poll the job until it finishes, printing its events; the interval doubles while
+        nothing happens, up to max_interval, and drops back when there is news
+        """
+        interval = self.poll_interval
+        while True:
+            job = await asyncio.to_thread(
+                self.client.fine_tuning.jobs.retrieve, self.state["job_id"]
+            )
+            events = await self.new_events()
+            for event in events:
+                print(f"{job.id} {event.message}", flush=True)
+            if events:
+                self.state["last_event_id"] = events[-1].id
+            self.state["status"] = job.status
+            self.save_state()
+            if job.status in FINISHED:
+                return job
+            interval = self.poll_interval if events else interval * 2
+            await asyncio.sleep(min(interval, self.max_interval))
+
+    async def run_async(self):
+        if self.state.get("status") == "succeeded":
+            return self.state["fine_tuned_model"]
+        await asyncio.gather(
+            self.upload("train_file", self.train_path),
+            self.upload("validation_file", self.validation_path),
+        )
+        await self.create()
+        job = await self.wait()
+        if job.status != "succeeded":
+            # The uploads are kept, but the next run starts a new job
+            for key in ["job_id", "last_event_id", "status"]:
+                self.state.pop(key, None)
+            self.save_state()
+            raise RuntimeError(f"Fine-tuning job {job.id} {job.status}: {job.error}")
+        self.state["fine_tuned_model"] = job.fine_tuned_model
+        self.save_state()
+        return job.fine_tuned_model
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+
+class FakeFineTuningClient:
+    """
+    Just enough of the OpenAI client for FineTuneJob: files.create and fine_tuning.jobs
+    Each job moves on a step every steps_per_status polls, logging an event each time
+    """
+
+    STATUSES = ["validating_files", "queued", "running", "succeeded"]
+
+    def __init__(self, steps_per_status=2, fail=False):
+        self.steps_per_status = steps_per_status
+        self.fail = fail
+        self.jobs = {}
+        self.uploads = []
+        self.files = SimpleNamespace(create=self.create_file)
+        self.fine_tuning = SimpleNamespace(
+            jobs=SimpleNamespace(
+                create=self.create_job,
+                retrieve=self.retrieve_job,
+                list_events=self.list_events,
+            )
+        )
+
+    def create_file(self, file, purpose):
+        self.uploads.append(file.name)
+        return SimpleNamespace(id=f"file-{uuid.uuid4().hex[:24]}", purpose=purpose)
+
+    def create_job(self, training_file, validation_file, model, suffix=None, **params):
+        job_id = f"ftjob-{uuid.uuid4().hex[:24]}"
+        self.jobs[job_id] = {
+            "model": model,
+            "suffix": suffix,
+            "polls": 0,
+            "events": [],
+        }
+        self.log(job_id, "Created fine-tuning job")
+        return self.retrieve_job(job_id, poll=False)
+
+    def log(self, job_id, message):
+        events = self.jobs[job_id]["events"]
+        events.append(
+            SimpleNamespace(
+                id=f"ftevent-{len(events)}-{uuid.uuid4().hex[:8]}",
+                created_at=int(time.time()),
+                level="info",
+                message=message,
+            )
+        )
+
+    def status(self, job):
+        step = min(job["polls"] // self.steps_per_status, len(self.STATUSES) - 1)
+        status = self.STATUSES[step]
+        return "failed" if status == "succeeded" and self.fail else status
+
+    def retrieve_job(self, job_id, poll=True):
+        job = self.jobs[job_id]
+        status = self.status(job)
+        if poll:
+            job["polls"] += 1
+            if self.status(job) != status:
+                status = self.status(job)
+                self.log(job_id, f"Job {status}")
+        model = job["model"]
+        return SimpleNamespace(
+            id=job_id,
+            status=status,
+            error=None if status != "failed" else {"message": "Training failed"},
+            fine_tuned_model=(
+                f"ft:{model}:personal:{job['suffix']}:{job_id[-8:]}"
+                if status == "succeeded"
+                else None
+            ),
+        )
+
+    def list_events(self, fine_tuning_job_id, limit=20, after=None):
+        events = self.jobs[fine_tuning_job_id]["events"][::-1]
+        if after is not None:
+            ids = [event.id for event in events]
+            events = events[ids.index(after) + 1 :]
+        return SimpleNamespace(data=events[:limit], has_more=len(events) > limit)
@@ -1,6 +1,5 @@
 from typing import Optional
-from transformers import AutoTokenizer
-import re
+import os
 
 BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
 
@@ -9,6 +8,98 @@ MAX_TOKENS = 160  # Truncate after this many tokens. Then after adding in prompt
 
 MIN_CHARS = 300
 CEILING_CHARS = MAX_TOKENS * 7
+CURATION_VERSION = 2  # bump when a change to the scrub or batch code changes its Items
+
+_tokenizers = {}
+
+
+def get_tokenizer():
+    """
+    Return the BASE_MODEL tokenizer for this process, loading it on first use
+    The cache is keyed by process id so a forked worker loads its own copy
+    rather than sharing the parent's Rust tokenizer state
+    """
+    pid = os.getpid()
+    tokenizer = _tokenizers.get(pid)
+    if tokenizer is None:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+        _tokenizers.clear()
+        _tokenizers[pid] = tokenizer
+    return tokenizer
+
+
+def preload():
+    """
+    Import transformers before a process pool forks its workers, so they inherit the
+    module instead of each paying the import, which takes seconds, while they start
+    """
+    from transformers import AutoTokenizer
+
+
+def warm_up():
+    """
+    Load the tokenizer up front, e.g. as a process pool initializer so each worker
+    pays the startup cost once before it receives any chunks
+    """
+    get_tokenizer()
+
+
+class LazyTokenizer:
+    """
+    Descriptor that resolves Item.tokenizer to the per-process tokenizer on access
+    """
+
+    def __get__(self, instance, owner):
+        return get_tokenizer()
+
+
+class Scrubber:
+    """
+    Precompiled text scrubbing used by Item
+    Measured on real details strings, a single alternation regex over the removals is slower
+    than chained str.replace (which doesn't copy when there is nothing to remove), so the
+    removals stay as replaces. The wins are collapsing separators with translate and split,
+    and filtering long words without a per-character generator
+    """
+
+    # Mapped to spaces, after which str.split() collapses them along with all whitespace
+    SEPARATORS = str.maketrans(dict.fromkeys(':[]"{}【】', " "))
+
+    def __init__(self, removals):
+        self.removals = tuple(removals)
+
+    def details(self, details):
+        """
+        Remove all of the removals from the details string
+        """
+        for remove in self.removals:
+            details = details.replace(remove, "")
+        return details
+
+    def text(self, stuff):
+        """
+        Collapse separators and whitespace, tidy up commas,
+        and drop words that are 7+ chars and contain numbers
+        """
+        stuff = " ".join(stuff.translate(self.SEPARATORS).split())
+        stuff = stuff.replace(" ,", ",").replace(",,,", ",").replace(",,", ",")
+        isdigit = str.isdigit
+        return " ".join(
+            [
+                word
+                for word in stuff.split(" ")
+                if len(word) < 7 or word.isalpha() or not any(map(isdigit, word))
+            ]
+        )
+
+    def many(self, texts):
+        """
+        Scrub a list of texts, e.g. every title in a chunk
+        """
+        text = self.text
+        return [text(stuff) for stuff in texts]
 
 
 class Item:
@@ -16,7 +107,7 @@ class Item:
     An Item is a cleaned, curated datapoint of a Product with a Price
     """
 
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+    tokenizer = LazyTokenizer()
     PREFIX = "Price is $"
     QUESTION = "How much does this cost to the nearest dollar?"
     REMOVALS = [
@@ -42,40 +133,33 @@ class Item:
     details: Optional[str]
     prompt: Optional[str] = None
     include = False
+    _prefix_tokens = None
+    _decode_cleans_up = None
 
     def __init__(self, data, price):
         self.title = data["title"]
         self.price = price
         self.parse(data)
 
+    scrubber = Scrubber(REMOVALS)
+
     def scrub_details(self):
         """
         Clean up the details string by removing common text that doesn't add value
         """
-        details = self.details
-        for remove in self.REMOVALS:
-            details = details.replace(remove, "")
-        return details
+        return self.scrubber.details(self.details)
 
     def scrub(self, stuff):
         """
         Clean up the provided text by removing unnecessary characters and whitespace
         Also remove words that are 7+ chars and contain numbers, as these are likely irrelevant product numbers
         """
-        stuff = re.sub(r'[:\[\]"{}【】\s]+', " ", stuff).strip()
-        stuff = stuff.replace(" ,", ",").replace(",,,", ",").replace(",,", ",")
-        words = stuff.split(" ")
-        select = [
-            word
-            for word in words
-            if len(word) < 7 or not any(char.isdigit() for char in word)
-        ]
-        return " ".join(select)
+        return self.scrubber.text(stuff)
 
-    def parse(self, data):
-        """6+
-        Parse this datapoint and if it fits within the allowed Token range,
-        then set include to True
+    def raw_contents(self, data):
+        """
+        Join the description, features and scrubbed details of this datapoint,
+        or return None if there isn't enough content to be worth tokenizing
         """
         contents = "\n".join(data["description"])
         if contents:
@@ -87,8 +171,26 @@ class Item:
         if self.details:
             contents += self.scrub_details() + "\n"
         if len(contents) > MIN_CHARS:
-            contents = contents[:CEILING_CHARS]
-            text = f"{self.scrub(self.title)}\n{self.scrub(contents)}"
+            return contents[:CEILING_CHARS]
+        return None
+
+    def contents_text(self, data):
+        """
+        Build the scrubbed title and contents text for this datapoint,
+        or return None if there isn't enough content to be worth tokenizing
+        """
+        contents = self.raw_contents(data)
+        if contents is not None:
+            return f"{self.scrub(self.title)}\n{self.scrub(contents)}"
+        return None
+
+    def parse(self, data):
+        """6+
+        Parse this datapoint and if it fits within the allowed Token range,
+        then set include to True
+        """
+        text = self.contents_text(data)
+        if text is not None:
             tokens = self.tokenizer.encode(text, add_special_tokens=False)
             if len(tokens) > MIN_TOKENS:
                 tokens = tokens[:MAX_TOKENS]
@@ -96,15 +198,128 @@ class Item:
                 self.make_prompt(text)
                 self.include = True
 
-    def make_prompt(self, text):
+    def make_prompt(self, text, token_count=None):
         """
         Set the prompt instance variable to be a prompt appropriate for training
+        If the token count is already known it is used instead of re-encoding the prompt
         """
         self.prompt = f"{self.QUESTION}\n\n{text}\n\n"
         self.prompt += f"{self.PREFIX}{str(round(self.price))}.00"
-        self.token_count = len(
-            self.tokenizer.encode(self.prompt, add_special_tokens=False)
+        if token_count is None:
+            token_count = len(
+                self.tokenizer.encode(self.prompt, add_special_tokens=False)
+            )
+        self.token_count = token_count
+
+    @classmethod
+    def prompt_prefix_tokens(cls):
+        """
+        Number of tokens in the question that starts every prompt, computed once
+        """
+        if cls._prefix_tokens is None:
+            cls._prefix_tokens = len(
+                cls.tokenizer.encode(f"{cls.QUESTION}\n\n", add_special_tokens=False)
+            )
+        return cls._prefix_tokens
+
+    @classmethod
+    def decode_cleans_up(cls):
+        """
+        Whether decode really cleans up tokenization spaces, found once by decoding a
+        space before a comma; the clean_up_tokenization_spaces flag can't be trusted, as
+        some tokenizers and transformers versions ignore it
+        """
+        if cls._decode_cleans_up is None:
+            ids = cls.tokenizer.encode("a ,", add_special_tokens=False)
+            cls._decode_cleans_up = cls.tokenizer.decode(ids) != "a ,"
+        return cls._decode_cleans_up
+
+    @classmethod
+    def truncate(cls, text, offsets):
+        """
+        Cut text after MAX_TOKENS tokens using the offset mapping from the fast tokenizer
+        Returns the same string as decoding the truncated tokens, or None if the cut falls
+        inside a multi-byte character and the tokens have to be decoded instead
+        """
+        if len(offsets) <= MAX_TOKENS:
+            end = len(text)
+        else:
+            end = offsets[MAX_TOKENS - 1][1]
+            if offsets[MAX_TOKENS][0] < end:
+                return None
+        return text[:end]
+
+    @classmethod
+    def batch(cls, datapoints, prices):
+        """
+        Create Items for a batch of datapoints and their prices
+        Uses one batched call to the fast tokenizer with offset mappings, so the text is truncated
+        to MAX_TOKENS without a decode, and the token_count of the prompt is worked out from the
+        cached length of the question plus the tokens of the text, re-encoding only the final word
+        together with the price. Falls back to the per-item path wherever that shortcut can't be
+        guaranteed to give an identical Item
+        """
+        tokenizer = cls.tokenizer
+        items = []
+        for data, price in zip(datapoints, prices):
+            item = cls.__new__(cls)
+            item.title = data["title"]
+            item.price = price
+            items.append(item)
+        if not tokenizer.is_fast:
+            for item, data in zip(items, datapoints):
+                item.parse(data)
+            return items
+
+        contents = [item.raw_contents(data) for item, data in zip(items, datapoints)]
+        pending = [i for i, text in enumerate(contents) if text is not None]
+        if not pending:
+            return items
+        titles = scrub_many([items[i].title for i in pending])
+        bodies = scrub_many([contents[i] for i in pending])
+        texts = [f"{title}\n{body}" for title, body in zip(titles, bodies)]
+        encodings = tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
         )
+        pre_tokenizer = tokenizer.backend_tokenizer.pre_tokenizer
+        cleanup = cls.decode_cleans_up()
+        tails, tail_items = [], []
+        for i, text, ids, offsets in zip(
+            pending, texts, encodings["input_ids"], encodings["offset_mapping"]
+        ):
+            if len(ids) <= MIN_TOKENS:
+                continue
+            item = items[i]
+            item.include = True
+            truncated = cls.truncate(text, offsets)
+            if truncated is None:
+                item.make_prompt(tokenizer.decode(ids[:MAX_TOKENS]))
+                continue
+            if cleanup and tokenizer.clean_up_tokenization(truncated) != truncated:
+                item.make_prompt(tokenizer.decode(ids[:MAX_TOKENS]))
+                continue
+            if text[0].isspace():
+                # Leading whitespace would merge with the newlines after the question
+                item.make_prompt(truncated)
+                continue
+            # Tokens never span pre-token boundaries, so everything before the last
+            # pre-token is counted from the offsets and only that piece is re-encoded
+            start = pre_tokenizer.pre_tokenize_str(truncated)[-1][1][0]
+            head = sum(
+                1 for token_start, _ in offsets[:MAX_TOKENS] if token_start < start
+            )
+            item.make_prompt(truncated, token_count=cls.prompt_prefix_tokens() + head)
+            tails.append(
+                f"{truncated[start:]}\n\n{cls.PREFIX}{str(round(item.price))}.00"
+            )
+            tail_items.append(item)
+        if tails:
+            tail_ids = tokenizer(tails, add_special_tokens=False)["input_ids"]
+            for item, ids in zip(tail_items, tail_ids):
+                item.token_count += len(ids)
+        return items
 
     def test_prompt(self):
         """
@@ -117,3 +332,10 @@ class Item:
         Return a String version of this Item
         """
         return f"<{self.title} = ${self.price}>"
+
+
+def scrub_many(texts):
+    """
+    Scrub a list of texts in one call, as Item.scrub would one at a time
+    """
+    return Item.scrubber.many(texts)
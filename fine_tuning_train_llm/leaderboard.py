@@ -0,0 +1,137 @@
+"""
+Leaderboard of the pricers in train_ml_model.py
+Each pricer is fitted and scored on the same test slice in a fresh process of its own,
+so the fit / predict wall-clock times and the peak memory reported are for that model
+alone. By default the pricers run one after another, which gives the most accurate
+times. With --workers N they run N at a time in parallel, each capped to its share of
+the cores: the table comes sooner, but the times are for a model on fewer threads.
+Models already saved by train_ml_model's registry are loaded rather than refitted, so
+the fit time of a rerun is the time to load them
+
+python leaderboard.py [--workers N] [pricer names...]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+COLUMNS = [
+    ("title", "Pricer", 26, "<", ""),
+    ("average_error", "Error $", 9, ">", ",.2f"),
+    ("rmsle", "RMSLE", 7, ">", ".2f"),
+    ("hit_rate", "Hits", 7, ">", ".1%"),
+    ("fit_seconds", "Fit s", 8, ">", ".1f"),
+    ("predict_seconds", "Predict s", 10, ">", ".3f"),
+    ("peak_mb", "Peak MB", 9, ">", ",.0f"),
+]
+THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of this process; ru_maxrss is in KB on Linux but bytes on macOS
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def limit_threads(threads):
+    """
+    Pool initializer that caps a worker to threads cores: the OpenMP and BLAS pools of
+    the libraries it imports later, and TRAINING_THREADS for the fits that take it
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    import train_ml_model
+
+    train_ml_model.TRAINING_THREADS = threads
+
+
+def cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def evaluate(name, size):
+    """
+    Fit or load the models the named pricer needs, then score it, timing each step
+    """
+    import train_ml_model
+    from testing import Tester
+
+    pricer, model_names = train_ml_model.PRICERS[name]
+    start = time.perf_counter()
+    for model_name in model_names:
+        train_ml_model.get_model(model_name)
+    fit_seconds = time.perf_counter() - start
+    random.seed(42)
+    start = time.perf_counter()
+    tester = Tester(
+        pricer, train_ml_model.test, size=size, chart=False, print_interval=None
+    )
+    metrics = tester.run()
+    metrics["fit_seconds"] = fit_seconds
+    metrics["predict_seconds"] = time.perf_counter() - start
+    metrics["peak_mb"] = peak_memory_mb()
+    return metrics
+
+
+def print_table(results):
+    """
+    Print the pricers from most to least accurate, with their cost
+    """
+    print(
+        " ".join(f"{header:{align}{width}}" for _, header, width, align, _ in COLUMNS)
+    )
+    for metrics in sorted(results, key=lambda metrics: metrics["average_error"]):
+        print(
+            " ".join(
+                f"{metrics[key]:{align}{width}{spec}}"
+                for key, _, width, align, spec in COLUMNS
+            )
+        )
+
+
+def run_leaderboard(names, size=250, workers=1, metrics_path=None):
+    """
+    Evaluate every named pricer in a fresh process each, workers at a time, and print
+    the table; with more than one worker, each is limited to its share of the cores
+    """
+    workers = min(workers, len(names))
+    threads = max(1, cores() // workers)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        max_tasks_per_child=1,
+        initializer=limit_threads if workers > 1 else None,
+        initargs=(threads,),
+    ) as pool:
+        results = list(pool.map(evaluate, names, [size] * len(names)))
+    print_table(results)
+    if metrics_path:
+        with open(metrics_path, "w") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    from train_ml_model import PRICERS
+
+    names = sys.argv[1:]
+    workers = 1
+    if "--workers" in names:
+        index = names.index("--workers")
+        workers = int(names[index + 1])
+        del names[index : index + 2]
+    run_leaderboard(names or list(PRICERS), workers=workers)
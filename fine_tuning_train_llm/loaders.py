@@ -1,18 +1,67 @@
 from datetime import datetime
+from itertools import islice
 from tqdm import tqdm
-from datasets import load_dataset
+from datasets import load_dataset, concatenate_datasets, Dataset
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from items import Item
+from items import Item, preload, warm_up
+from caches import CACHE_PATH, datapoint_key, open_cache
 
 CHUNK_SIZE = 1000
 MIN_PRICE = 0.5
 MAX_PRICE = 999.49
+ITEM_FIELDS = ["title", "price", "details", "prompt", "token_count"]
+
+worker_loaders = {}
+
+
+def to_columns(items):
+    """
+    Flatten curated Items into a dict of lists, which pickles far smaller than the Items
+    """
+    return {field: [getattr(item, field) for item in items] for field in ITEM_FIELDS}
+
+
+def from_columns(columns, category):
+    """
+    Rebuild the curated Items from a dict of lists made by to_columns
+    """
+    items = []
+    for values in zip(*(columns[field] for field in ITEM_FIELDS)):
+        item = Item.__new__(Item)
+        for field, value in zip(ITEM_FIELDS, values):
+            setattr(item, field, value)
+        item.include = True
+        item.category = category
+        items.append(item)
+    return items
+
+
+def curate_range(name, cache_files, start, stop, cache_path=CACHE_PATH):
+    """
+    Curate the datapoints start:stop of a dataset and return them as columns
+    Each worker memory-maps the Arrow cache files of a dataset the first time it is
+    sent a range from it, so only the index range and file names cross the process boundary
+    """
+    loader = worker_loaders.get(name)
+    if loader is None:
+        loader = ItemLoader(name, cache_path)
+        loader.dataset = concatenate_datasets(
+            [Dataset.from_file(filename) for filename in cache_files]
+        )
+        worker_loaders[name] = loader
+    chunk = loader.dataset.select(range(start, stop))
+    return to_columns(loader.from_chunk(chunk))
 
 
 class ItemLoader:
 
-    def __init__(self, name):
+    def __init__(self, name, cache_path=CACHE_PATH):
+        """
+        cache_path is the SQLite file where curated Items are cached between runs,
+        or None to curate every datapoint afresh
+        """
         self.name = name
+        self.cache_path = cache_path
         self.dataset = None
 
     def from_datapoint(self, datapoint):
@@ -20,26 +69,56 @@ class ItemLoader:
         Try to create an Item from this datapoint
         Return the Item if successful, or None if it shouldn't be included
         """
+        price = self.price_for(datapoint)
+        if price is not None:
+            item = Item(datapoint, price)
+            return item if item.include else None
+
+    def price_for(self, datapoint):
+        """
+        Return the price of this datapoint if it is within the allowed range, otherwise None
+        """
         try:
             price_str = datapoint["price"]
             if price_str:
                 price = float(price_str)
                 if MIN_PRICE <= price <= MAX_PRICE:
-                    item = Item(datapoint, price)
-                    return item if item.include else None
+                    return price
         except ValueError:
             return None
 
     def from_chunk(self, chunk):
         """
         Create a list of Items from this chunk of elements from the Dataset
+        The datapoints with a usable price are tokenized together in one batch
         """
-        batch = []
+        datapoints, prices = [], []
         for datapoint in chunk:
-            result = self.from_datapoint(datapoint)
-            if result:
-                batch.append(result)
-        return batch
+            price = self.price_for(datapoint)
+            if price is not None:
+                datapoints.append(datapoint)
+                prices.append(price)
+        if self.cache_path is None:
+            return [item for item in Item.batch(datapoints, prices) if item.include]
+        return self.from_cache_or_batch(datapoints, prices)
+
+    def from_cache_or_batch(self, datapoints, prices):
+        """
+        Take the Items already curated with the current config from the cache,
+        and batch-curate and cache only the datapoints that are new or have changed
+        """
+        cache = open_cache(self.cache_path)
+        keys = [datapoint_key(data, price) for data, price in zip(datapoints, prices)]
+        cached = cache.get_many(keys)
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        if misses:
+            fresh = Item.batch(
+                [datapoints[i] for i in misses], [prices[i] for i in misses]
+            )
+            cache.put_many([keys[i] for i in misses], fresh)
+            cached.update(zip([keys[i] for i in misses], fresh))
+        results = [cached[key] for key in keys]
+        return [item for item in results if item is not None and item.include]
 
     def chunk_generator(self):
         """
@@ -49,39 +128,100 @@ class ItemLoader:
         for i in range(0, size, CHUNK_SIZE):
             yield self.dataset.select(range(i, min(i + CHUNK_SIZE, size)))
 
-    def load_in_parallel(self, workers):
+    def range_generator(self):
+        """
+        Iterate over the Dataset, yielding the (start, stop) index range of each chunk
+        """
+        size = len(self.dataset)
+        for i in range(0, size, CHUNK_SIZE):
+            yield i, min(i + CHUNK_SIZE, size)
+
+    def cache_files(self):
+        """
+        The Arrow files backing the loaded Dataset, or an empty list if it is only in memory
+        """
+        return [cache["filename"] for cache in self.dataset.cache_files]
+
+    def load_in_parallel(self, workers, store=None):
         """
         Use concurrent.futures to farm out the work to process chunks of datapoints -
         This speeds up processing significantly, but will tie up your computer while it's doing so!
+        When the dataset is backed by Arrow cache files, each worker memory-maps them and is only
+        sent (start, stop) ranges, and returns columns rather than pickled Items
+        If an ItemStore is given, each chunk is appended to it instead of collecting Items in a list
         """
         results = []
-        chunk_count = (len(self.dataset) // CHUNK_SIZE) + 1
-        with ProcessPoolExecutor(max_workers=workers) as pool:
-            for batch in tqdm(
-                pool.map(self.from_chunk, self.chunk_generator()), total=chunk_count
-            ):
-                results.extend(batch)
-        for result in results:
-            result.category = self.name
+        size = len(self.dataset)
+        chunk_count = (size // CHUNK_SIZE) + 1
+        cache_files = self.cache_files()
+        preload()
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up)
+        if cache_files:
+            ranges = list(self.range_generator())
+            batches = pool.map(
+                curate_range,
+                [self.name] * len(ranges),
+                [cache_files] * len(ranges),
+                *zip(*ranges),
+                [self.cache_path] * len(ranges),
+            )
+        else:
+            batches = (
+                to_columns(batch)
+                for batch in pool.map(self.from_chunk, self.chunk_generator())
+            )
+        with pool:
+            for columns in tqdm(batches, total=chunk_count):
+                if store is not None:
+                    store.extend_columns(columns, self.name)
+                else:
+                    results.extend(from_columns(columns, self.name))
+        if store is not None:
+            return store
         return results
 
-    def load(self, workers=5):
+    def hub_chunks(self):
         """
-        Load in this dataset; the workers parameter specifies how many processes
-        should work on loading and scrubbing the data
+        Stream this dataset from the Hub, yielding lists of CHUNK_SIZE datapoints
+        """
+        print(f"Streaming dataset {self.name}", flush=True)
+        dataset = load_dataset(
+            "McAuley-Lab/Amazon-Reviews-2023",
+            f"raw_meta_{self.name}",
+            split="full",
+            streaming=True,
+            trust_remote_code=True,
+        )
+        datapoints = iter(dataset)
+        while chunk := list(islice(datapoints, CHUNK_SIZE)):
+            yield chunk
+
+    def open(self):
+        """
+        Download (or reuse the cached copy of) this dataset, without curating it yet
         """
-        start = datetime.now()
-        print(f"Loading dataset {self.name}", flush=True)
         self.dataset = load_dataset(
             "McAuley-Lab/Amazon-Reviews-2023",
             f"raw_meta_{self.name}",
             split="full",
             trust_remote_code=True,
         )
-        results = self.load_in_parallel(workers)
+        return self.dataset
+
+    def load(self, workers=5, store=None):
+        """
+        Load in this dataset; the workers parameter specifies how many processes
+        should work on loading and scrubbing the data
+        Pass an ItemStore to append the curated Items to it as columns rather than return a list
+        """
+        start = datetime.now()
+        print(f"Loading dataset {self.name}", flush=True)
+        self.open()
+        before = len(store) if store is not None else 0
+        results = self.load_in_parallel(workers, store)
         finish = datetime.now()
         print(
-            f"Completed {self.name} with {len(results):,} datapoints in {(finish-start).total_seconds()/60:.1f} mins",
+            f"Completed {self.name} with {len(results) - before:,} datapoints in {(finish-start).total_seconds()/60:.1f} mins",
             flush=True,
         )
         return results
@@ -0,0 +1,223 @@
+"""
+A persistent cache of chat model responses for repeatable calls
+A pricer called with a fixed seed (or at temperature 0) gives the same answer for the
+same item every run, so its responses are saved in SQLite, keyed by a hash of the model,
+messages and sampling parameters, and a re-run evaluation doesn't pay for them again.
+CachedOpenAI and CachedAnthropic wrap the clients; everything other than creating
+completions, down to the other methods of chat.completions and messages, is passed
+through to the wrapped client
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from openai.types.chat import ChatCompletion
+from anthropic.types import Message
+
+RESPONSE_CACHE_PATH = "data/response_cache.sqlite"
+EVICT_EVERY = 1000  # puts between evictions
+
+
+def request_key(provider, params):
+    """
+    Hash of everything that determines a response: the model, messages and parameters
+    """
+    request = json.dumps([provider, params], sort_keys=True, default=str)
+    return hashlib.sha256(request.encode()).digest()
+
+
+def is_repeatable(params, always=False):
+    """
+    Only calls with a fixed seed or at temperature 0 are expected to repeat themselves,
+    unless always is set, e.g. for models that take neither; streams are never cached
+    """
+    if params.get("stream"):
+        return False
+    return always or params.get("seed") is not None or params.get("temperature") == 0
+
+
+class ResponseCache:
+    """
+    Responses in SQLite, expired after ttl seconds and trimmed to the max_entries most
+    recently used; safe to share between Tester's threads
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key BLOB PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                used REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_used ON responses (used)"
+        )
+        self.connection.commit()
+        self.evict()
+
+    def get(self, key):
+        """
+        The cached response as a dict, or None if there isn't one that is still fresh
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", [key]
+            ).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE responses SET used = ? WHERE key = ?", [now, key]
+                )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, provider, model, response):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                [key, provider, model, json.dumps(response), now, now],
+            )
+            self.puts += 1
+        if self.puts % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete expired responses, then the least recently used beyond max_entries
+        """
+        deleted = 0
+        with self.lock, self.connection:
+            if self.ttl is not None:
+                deleted += self.connection.execute(
+                    "DELETE FROM responses WHERE created < ?", [time.time() - self.ttl]
+                ).rowcount
+            if self.max_entries is not None:
+                deleted += self.connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                    "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    [self.max_entries],
+                ).rowcount
+        return deleted
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def __repr__(self):
+        stats = self.stats()
+        return (
+            f"<ResponseCache {stats['entries']:,} entries, {stats['hits']:,} hits, "
+            f"{stats['misses']:,} misses ({stats['hit_rate']:.0%} hit rate)>"
+        )
+
+
+def cached_call(cache, provider, create, response_type, params, always=False):
+    """
+    The cached response for these params, or the response of create, which is cached
+    """
+    if not is_repeatable(params, always):
+        return create(**params)
+    key = request_key(provider, params)
+    cached = cache.get(key)
+    if cached is not None:
+        return response_type.model_validate(cached)
+    response = create(**params)
+    cache.put(key, provider, params.get("model", ""), response.model_dump(mode="json"))
+    return response
+
+
+class Intercept:
+    """
+    Stands in for part of a client, answering the given attributes itself and passing
+    every other attribute through to the part it wraps
+    """
+
+    def __init__(self, wrapped, **attributes):
+        self.__dict__.update(attributes, wrapped=wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+class CachedOpenAI:
+    """
+    An OpenAI client whose chat.completions.create is answered from the cache if it can
+    """
+
+    def __init__(self, client, cache=None, always=False):
+        self.client = client
+        self.cache = cache or ResponseCache()
+        self.always = always
+        self.chat = Intercept(
+            client.chat,
+            completions=Intercept(client.chat.completions, create=self.create),
+        )
+
+    def create(self, **params):
+        return cached_call(
+            self.cache,
+            "openai",
+            self.client.chat.completions.create,
+            ChatCompletion,
+            params,
+            self.always,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class CachedAnthropic:
+    """
+    An Anthropic client whose messages.create is answered from the cache if it can
+    """
+
+    def __init__(self, client, cache=None, always=False):
+        self.client = client
+        self.cache = cache or ResponseCache()
+        self.always = always
+        self.messages = Intercept(client.messages, create=self.create)
+
+    def create(self, **params):
+        return cached_call(
+            self.cache,
+            "anthropic",
+            self.client.messages.create,
+            Message,
+            params,
+            self.always,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
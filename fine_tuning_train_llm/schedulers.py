@@ -0,0 +1,181 @@
+import os
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from items import preload, warm_up
+from loaders import CHUNK_SIZE, ItemLoader, curate_range, from_columns
+from caches import CACHE_PATH
+from dedup import signatures, text_for
+
+
+def default_workers():
+    """
+    One worker per core available to this process, leaving one for the parent
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, cores - 1)
+
+
+def sign_chunk(loader, chunk):
+    """
+    Curate a chunk of datapoints and compute the MinHash signature of each Item, so
+    dedup doesn't need a pool of its own
+    """
+    items = loader.from_chunk(chunk)
+    return items, signatures([text_for(item) for item in items]) if items else None
+
+
+class CategoryStats:
+    """
+    Throughput counters for one category while it is being curated
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.datapoints = 0
+        self.accepted = 0
+        self.start = None
+        self.finish = None
+
+    def record(self, datapoints, accepted):
+        self.datapoints += datapoints
+        self.accepted += accepted
+        self.finish = datetime.now()
+
+    def seconds(self):
+        if self.start is None or self.finish is None:
+            return 0.0
+        return max((self.finish - self.start).total_seconds(), 1e-9)
+
+    def __repr__(self):
+        seconds = self.seconds()
+        rate = self.accepted / seconds if seconds else 0
+        accept_rate = self.accepted / self.datapoints if self.datapoints else 0
+        return (
+            f"{self.name:<30} {self.datapoints:>10,} datapoints {self.accepted:>9,} items "
+            f"accept {accept_rate*100:5.1f}% {rate:8,.0f} items/s"
+        )
+
+
+class CurationScheduler:
+    """
+    Curate several categories with one long-lived process pool
+    Chunks are queued category by category with at most max_pending in flight, so the
+    next category starts as soon as workers free up from the last one and the pool stays
+    busy across all of them. Chunks are collected in the order they were queued, so each
+    is written out as soon as it arrives; only the chunks in flight are held in memory
+    """
+
+    def __init__(self, names, workers=None, max_pending=None, cache_path=CACHE_PATH):
+        self.names = names
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or 2 * self.workers
+        self.loaders = {name: ItemLoader(name, cache_path) for name in names}
+        self.stats = {}
+
+    def tasks(self):
+        """
+        Every (name, cache_files, start, stop, cache_path) chunk, category by category
+        """
+        for name, loader in self.loaders.items():
+            cache_files = loader.cache_files()
+            for start, stop in loader.range_generator():
+                yield name, cache_files, start, stop, loader.cache_path
+
+    def curated(self, submissions):
+        """
+        Submit (name, size, function, args) chunks to one pool, keeping at most
+        max_pending in flight, and yield (name, size, result) in submission order
+        """
+        pending = deque()
+        preload()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up) as pool:
+            while True:
+                for name, size, function, args in islice(
+                    submissions, self.max_pending - len(pending)
+                ):
+                    stats = self.stats.setdefault(name, CategoryStats(name))
+                    stats.start = stats.start or datetime.now()
+                    pending.append((name, size, pool.submit(function, *args)))
+                if not pending:
+                    break
+                name, size, future = pending.popleft()
+                yield name, size, future.result()
+
+    def load(self, store=None):
+        """
+        Load and curate every category; returns the Items in the same order as loading
+        each category in turn would, or appends them to the given ItemStore
+        """
+        start = datetime.now()
+        for name, loader in self.loaders.items():
+            print(f"Loading dataset {name}", flush=True)
+            loader.open()
+        chunk_count = sum(
+            len(range(0, len(loader.dataset), CHUNK_SIZE))
+            for loader in self.loaders.values()
+        )
+        print(
+            f"Curating {len(self.names)} categories in {chunk_count:,} chunks with {self.workers} workers",
+            flush=True,
+        )
+        submissions = (
+            (task[0], task[3] - task[2], curate_range, task) for task in self.tasks()
+        )
+        items = []
+        for name, size, columns in tqdm(self.curated(submissions), total=chunk_count):
+            self.stats[name].record(size, len(columns["price"]))
+            if store is not None:
+                store.extend_columns(columns, name)
+            else:
+                items.extend(from_columns(columns, name))
+        self.report(start)
+        return store if store is not None else items
+
+    def stream_chunks(self, sign=False):
+        """
+        Stream every category from the Hub through the one pool and yield the curated
+        Items of each chunk as it completes, in the same order as streaming each
+        category in turn; with sign, the workers also compute the Items' MinHash
+        signatures and (items, signatures) is yielded for dedup_signed
+        """
+        start = datetime.now()
+        function = sign_chunk if sign else ItemLoader.from_chunk
+        submissions = (
+            (name, len(chunk), function, (loader, chunk))
+            for name, loader in self.loaders.items()
+            for chunk in loader.hub_chunks()
+        )
+        for name, size, result in self.curated(submissions):
+            items = result[0] if sign else result
+            self.stats[name].record(size, len(items))
+            for item in items:
+                item.category = name
+            yield result
+        self.report(start)
+
+    def stream(self):
+        """
+        Stream every category from the Hub through the one pool and yield curated Items
+        as their chunks complete, in the same order as streaming each category in turn
+        """
+        for items in self.stream_chunks():
+            yield from items
+
+    def report(self, start):
+        """
+        Print throughput and accept rate per category, and overall
+        """
+        seconds = (datetime.now() - start).total_seconds()
+        for stats in self.stats.values():
+            print(stats, flush=True)
+        total = sum(stats.accepted for stats in self.stats.values())
+        print(
+            f"Completed {len(self.names)} categories with {total:,} datapoints in {seconds/60:.1f} mins",
+            flush=True,
+        )
@@ -0,0 +1,194 @@
+import random
+from collections import Counter
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from items import Item
+
+STRING_COLUMNS = ["title", "details", "prompt", "category"]
+
+
+def reservoir_sample(items, size, seed=42):
+    """
+    Uniformly sample up to size items from an iterable of unknown length in one pass,
+    holding only the sample in memory, and return it shuffled
+    """
+    rng = random.Random(seed)
+    sample = []
+    for seen, item in enumerate(items):
+        if seen < size:
+            sample.append(item)
+        else:
+            index = rng.randint(0, seen)
+            if index < size:
+                sample[index] = item
+    rng.shuffle(sample)
+    return sample
+
+
+class ItemStore:
+    """
+    A columnar store of curated Items, for corpora too large to hold as Python objects
+    Strings are kept in Arrow arrays and prices / token counts in NumPy arrays,
+    appended a chunk at a time as ItemLoader produces them
+    """
+
+    def __init__(self):
+        self.chunks = {name: [] for name in STRING_COLUMNS}
+        self.price_chunks = []
+        self.token_count_chunks = []
+        self.columns = None
+        self.size = 0
+
+    def extend(self, items, category=None):
+        """
+        Append a batch of Items, setting their category if one is given
+        """
+        columns = {
+            name: [getattr(item, name, None) for item in items]
+            for name in STRING_COLUMNS + ["price", "token_count"]
+        }
+        self.extend_columns(columns, category)
+
+    def extend_columns(self, columns, category=None):
+        """
+        Append a batch given as a dict of lists, as returned by the ItemLoader workers
+        """
+        size = len(columns["price"])
+        if not size:
+            return
+        for name in STRING_COLUMNS:
+            if name == "category" and category is not None:
+                values = [category] * size
+            else:
+                values = columns.get(name, [None] * size)
+            self.chunks[name].append(pa.array(values, type=pa.large_string()))
+        self.price_chunks.append(np.array(columns["price"], dtype=np.float64))
+        self.token_count_chunks.append(
+            np.array(columns["token_count"], dtype=np.int32)
+        )
+        self.columns = None
+        self.size += size
+
+    def column(self, name):
+        """
+        Return a whole column: an Arrow array for strings, a NumPy array for price and token_count
+        The chunks are combined on first access after an append
+        """
+        if self.columns is None:
+            self.columns = {
+                name: pa.chunked_array(chunks, type=pa.large_string()).combine_chunks()
+                for name, chunks in self.chunks.items()
+            }
+            self.columns["price"] = np.concatenate(self.price_chunks or [[]])
+            self.columns["token_count"] = np.concatenate(
+                self.token_count_chunks or [np.array([], dtype=np.int32)]
+            )
+        return self.columns[name]
+
+    @property
+    def prices(self):
+        return self.column("price")
+
+    @property
+    def token_counts(self):
+        return self.column("token_count")
+
+    def value(self, name, index):
+        """
+        Return a single value from a column as a Python object
+        """
+        value = self.column(name)[index]
+        return value.as_py() if isinstance(value, pa.Scalar) else value.item()
+
+    def category_counts(self):
+        """
+        Count the items in each category, without materialising the column
+        """
+        counts = pc.value_counts(self.column("category"))
+        values = counts.field("values").to_pylist()
+        return Counter(dict(zip(values, counts.field("counts").to_pylist())))
+
+    def shuffled_indices(self, seed=42, indices=None):
+        """
+        Return every index (or just the given ones) in the same order
+        random.shuffle would put a list of those items in
+        """
+        indices = list(range(self.size)) if indices is None else list(indices)
+        random.seed(seed)
+        random.shuffle(indices)
+        return indices
+
+    def item(self, index):
+        """
+        Materialise a real Item, e.g. for the train / test pickles
+        """
+        item = Item.__new__(Item)
+        for name in ["title", "price", "details", "prompt", "token_count"]:
+            setattr(item, name, self.value(name, index))
+        item.include = True
+        item.category = self.value("category", index)
+        return item
+
+    def items(self, indices):
+        return [self.item(index) for index in indices]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not -self.size <= index < self.size:
+            raise IndexError("ItemStore index out of range")
+        return ItemView(self, index % self.size)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield ItemView(self, index)
+
+
+class ItemView:
+    """
+    A lightweight, read-only view of one row of an ItemStore that behaves like an Item
+    """
+
+    __slots__ = ("store", "index")
+
+    PREFIX = Item.PREFIX
+    include = True
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def title(self):
+        return self.store.value("title", self.index)
+
+    @property
+    def details(self):
+        return self.store.value("details", self.index)
+
+    @property
+    def prompt(self):
+        return self.store.value("prompt", self.index)
+
+    @property
+    def category(self):
+        return self.store.value("category", self.index)
+
+    @property
+    def price(self):
+        return self.store.value("price", self.index)
+
+    @property
+    def token_count(self):
+        return self.store.value("token_count", self.index)
+
+    def test_prompt(self):
+        """
+        Return a prompt suitable for testing, with the actual price removed
+        """
+        return self.prompt.split(self.PREFIX)[0] + self.PREFIX
+
+    def __repr__(self):
+        return f"<{self.title} = ${self.price}>"
@@ -1,5 +1,13 @@
+import os
+import csv
+import json
 import math
-import matplotlib.pyplot as plt
+import time
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
@@ -8,13 +16,69 @@ RESET = "\033[0m"
 COLOR_MAP = {"red": RED, "orange": YELLOW, "green": GREEN}
 
 
+class RateLimiter:
+    """
+    Spaces out calls so that no more than rate start per second, across threads or tasks
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def delay(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_call)
+            self.next_call = start + self.interval
+            return start - now
+
+    def wait(self):
+        time.sleep(self.delay())
+
+    async def wait_async(self):
+        await asyncio.sleep(self.delay())
+
+
 class Tester:
 
-    def __init__(self, predictor, data, title=None, size=250):
+    def __init__(
+        self,
+        predictor,
+        data,
+        title=None,
+        size=250,
+        concurrency=1,
+        rate_limit=None,
+        retries=0,
+        backoff=1.0,
+        chart=True,
+        print_interval=0.0,
+        metrics_path=None,
+    ):
+        """
+        concurrency > 1 calls the predictor from a thread pool of that size, or as that many
+        concurrent tasks if the predictor is an async function; rate_limit caps calls per second
+        and failed calls are retried up to retries times with exponential backoff
+        Results are always recorded in the order of the data, whatever order they finish in
+        chart is True to show the chart, a file name to save it to, or False for no chart;
+        per-item lines are printed at most every print_interval seconds (None for none);
+        metrics are appended to metrics_path, as a CSV row or a JSON line by its extension
+        """
         self.predictor = predictor
         self.data = data
         self.title = title or predictor.__name__.replace("_", " ").title()
         self.size = size
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.retries = retries
+        self.backoff = backoff
+        self.show_chart = chart
+        self.print_interval = print_interval
+        self.metrics_path = metrics_path
+        self.last_print = None
+        self.failed = 0
+        self.latencies = []
         self.guesses = []
         self.truths = []
         self.errors = []
@@ -29,30 +93,150 @@ class Tester:
         else:
             return "red"
 
-    def run_datapoint(self, i):
+    def predict(self, datapoint):
+        """
+        Call the predictor, waiting for the rate limiter and retrying on errors
+        """
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                self.limiter.wait()
+            try:
+                start = time.perf_counter()
+                guess = self.predictor(datapoint)
+                self.latencies.append(time.perf_counter() - start)
+                return guess
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+
+    async def predict_async(self, datapoint, semaphore):
+        """
+        As predict, for an async predictor, with at most concurrency calls in flight
+        """
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                if self.limiter:
+                    await self.limiter.wait_async()
+                try:
+                    start = time.perf_counter()
+                    guess = await self.predictor(datapoint)
+                    self.latencies.append(time.perf_counter() - start)
+                    return guess
+                except Exception:
+                    if attempt == self.retries:
+                        raise
+                    await asyncio.sleep(self.backoff * 2**attempt)
+
+    def predict_or_nan(self, datapoint):
+        """
+        As predict, but a datapoint that still fails after the retries gives NaN, which
+        run_batch leaves out of the scores, rather than losing the calls already made
+        """
+        try:
+            return self.predict(datapoint)
+        except Exception:
+            return math.nan
+
+    async def gather(self, datapoints):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        guesses = await asyncio.gather(
+            *(self.predict_async(datapoint, semaphore) for datapoint in datapoints),
+            return_exceptions=True,
+        )
+        return [
+            math.nan if isinstance(guess, Exception) else guess for guess in guesses
+        ]
+
+    def predict_all(self):
+        """
+        Return the guesses for the first size datapoints, in order, with NaN for any
+        datapoint that still failed after the retries; it is an error if they all did
+        """
+        datapoints = [self.data[i] for i in range(self.size)]
+        if inspect.iscoroutinefunction(self.predictor):
+            guesses = asyncio.run(self.gather(datapoints))
+        elif self.concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                guesses = list(pool.map(self.predict_or_nan, datapoints))
+        else:
+            guesses = [self.predict(datapoint) for datapoint in datapoints]
+        if all(math.isnan(guess) for guess in guesses):
+            raise RuntimeError(f"All {len(guesses):,} predictions failed")
+        return guesses
+
+    def run_datapoint(self, i, guess=None):
         datapoint = self.data[i]
-        guess = self.predictor(datapoint)
+        if guess is None:
+            guess = self.predict(datapoint)
         truth = datapoint.price
         error = abs(guess - truth)
         log_error = math.log(truth + 1) - math.log(guess + 1)
         sle = log_error**2
         color = self.color_for(error, truth)
-        title = (
-            datapoint.title
-            if len(datapoint.title) <= 40
-            else datapoint.title[:40] + "..."
-        )
         self.guesses.append(guess)
         self.truths.append(truth)
         self.errors.append(error)
         self.sles.append(sle)
         self.colors.append(color)
+        self.print_datapoint(i, guess, truth, error, sle, color)
+
+    def run_batch(self, guesses):
+        """
+        Score a whole array of guesses at once with NumPy array operations
+        A NaN guess marks a datapoint the predictor failed on, which isn't scored
+        """
+        guesses = np.asarray(guesses, dtype=float)
+        indices = np.flatnonzero(~np.isnan(guesses))
+        self.failed = len(guesses) - len(indices)
+        guesses = guesses[indices]
+        truths = np.array([self.data[i].price for i in indices], dtype=float)
+        errors = np.abs(guesses - truths)
+        sles = (np.log(truths + 1) - np.log(guesses + 1)) ** 2
+        ratios = errors / truths
+        colors = np.select(
+            [(errors < 40) | (ratios < 0.2), (errors < 80) | (ratios < 0.4)],
+            ["green", "orange"],
+            "red",
+        )
+        self.guesses = guesses.tolist()
+        self.truths = truths.tolist()
+        self.errors = errors.tolist()
+        self.sles = sles.tolist()
+        self.colors = colors.tolist()
+        for j, i in enumerate(indices.tolist()):
+            self.print_datapoint(
+                i,
+                self.guesses[j],
+                self.truths[j],
+                self.errors[j],
+                self.sles[j],
+                self.colors[j],
+            )
+
+    def print_datapoint(self, i, guess, truth, error, sle, color):
+        if self.print_interval is None:
+            return
+        now = time.monotonic()
+        last = i == self.size - 1
+        if self.last_print is not None and now - self.last_print < self.print_interval:
+            if not last:
+                return
+        self.last_print = now
+        datapoint = self.data[i]
+        title = (
+            datapoint.title
+            if len(datapoint.title) <= 40
+            else datapoint.title[:40] + "..."
+        )
         print(
             f"{COLOR_MAP[color]}{i+1}: Guess: ${guess:,.2f} Truth: ${truth:,.2f} Error: ${error:,.2f} SLE: {sle:,.2f} Item: {title}{RESET}"
         )
 
     def chart(self, title):
-        max_error = max(self.errors)
+        # pyplot is slow to import and headless runs never chart, so it is imported here
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(12, 8))
         max_val = max(max(self.truths), max(self.guesses))
         plt.plot([0, max_val], [0, max_val], color="deepskyblue", lw=2, alpha=0.6)
@@ -62,21 +246,76 @@ class Tester:
         plt.xlim(0, max_val)
         plt.ylim(0, max_val)
         plt.title(title)
-        plt.show()
+        if self.show_chart is True:
+            plt.show()
+        else:
+            plt.savefig(self.show_chart)
+            plt.close()
+
+    def metrics(self):
+        """
+        Summary metrics for this run, including predictor latency percentiles in milliseconds
+        """
+        latencies = np.array(self.latencies or [np.nan]) * 1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        scored = len(self.errors)
+        return {
+            "title": self.title,
+            "size": self.size,
+            "average_error": sum(self.errors) / scored,
+            "rmsle": math.sqrt(sum(self.sles) / scored),
+            "hit_rate": sum(1 for color in self.colors if color == "green") / scored,
+            "latency_ms_p50": float(p50),
+            "latency_ms_p90": float(p90),
+            "latency_ms_p99": float(p99),
+        }
+
+    def export(self, metrics):
+        """
+        Append the metrics to metrics_path: a row if it ends in .csv, otherwise a JSON line
+        """
+        if self.metrics_path.endswith(".csv"):
+            new_file = not os.path.exists(self.metrics_path)
+            with open(self.metrics_path, "a", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=list(metrics))
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(metrics)
+        else:
+            with open(self.metrics_path, "a") as file:
+                file.write(json.dumps(metrics) + "\n")
 
     def report(self):
-        average_error = sum(self.errors) / self.size
-        rmsle = math.sqrt(sum(self.sles) / self.size)
-        hits = sum(1 for color in self.colors if color == "green")
-        title = f"{self.title} Error=${average_error:,.2f} RMSLE={rmsle:,.2f} Hits={hits/self.size*100:.1f}%"
-        self.chart(title)
+        metrics = self.metrics()
+        average_error = metrics["average_error"]
+        rmsle = metrics["rmsle"]
+        hits = metrics["hit_rate"]
+        title = f"{self.title} Error=${average_error:,.2f} RMSLE={rmsle:,.2f} Hits={hits*100:.1f}%"
+        if self.failed:
+            title += f" ({self.failed:,} of {self.size:,} failed, not scored)"
+        print(title, flush=True)
+        if self.metrics_path:
+            self.export(metrics)
+        if self.show_chart:
+            self.chart(title)
+        return metrics
 
     def run(self):
         self.error = 0
-        for i in range(self.size):
-            self.run_datapoint(i)
-        self.report()
+        predict_batch = getattr(self.predictor, "predict_batch", None)
+        if predict_batch is not None:
+            # Vectorised models score the whole slice in one call
+            start = time.perf_counter()
+            guesses = predict_batch([self.data[i] for i in range(self.size)])
+            self.latencies = [(time.perf_counter() - start) / self.size] * self.size
+            self.run_batch(guesses)
+        elif self.concurrency > 1 or inspect.iscoroutinefunction(self.predictor):
+            self.run_batch(self.predict_all())
+        else:
+            for i in range(self.size):
+                self.run_datapoint(i)
+        return self.report()
 
     @classmethod
-    def test(cls, function, data):
-        cls(function, data).run()
+    def test(cls, function, data, **kwargs):
+        return cls(function, data, **kwargs).run()
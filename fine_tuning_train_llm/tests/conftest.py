@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other as scripts run from fine_tuning_train_llm do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
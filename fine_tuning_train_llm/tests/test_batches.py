@@ -0,0 +1,82 @@
+import os
+import re
+import pickle
+import threading
+import pytest
+from batches import LocalBatchClient, batch_predictor
+import testing
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+
+def messages_for(item):
+    return [{"role": "user", "content": item.test_prompt()}]
+
+
+def parse(reply):
+    return float(re.search(r"[\d.]+", reply).group())
+
+
+class FlakyModel:
+    """
+    Replies with a fixed price, failing every fail_every-th request
+    """
+
+    def __init__(self, fail_every):
+        self.fail_every = fail_every
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, body):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        if calls % self.fail_every == 0:
+            raise RuntimeError("model overloaded")
+        return "Price is $100.00"
+
+
+@pytest.fixture
+def test_items():
+    with open(os.path.join(DATA_DIR, "test_lite.pkl"), "rb") as file:
+        return pickle.load(file)[:100]
+
+
+def predictor(fail_every, tmp_path, **kwargs):
+    return batch_predictor(
+        LocalBatchClient(FlakyModel(fail_every)),
+        "local-model",
+        messages_for,
+        parse,
+        work_dir=str(tmp_path),
+        poll_interval=0.01,
+        **kwargs,
+    )
+
+
+def test_failed_requests_are_not_scored(test_items, tmp_path):
+    tester = testing.Tester(
+        predictor(25, tmp_path),
+        test_items,
+        size=100,
+        chart=False,
+        print_interval=None,
+    )
+    metrics = tester.run()
+    assert tester.failed == 4
+    assert len(tester.guesses) == 96
+    scored = [item for i, item in enumerate(test_items) if (i + 1) % 25]
+    errors = [abs(100 - item.price) for item in scored]
+    assert metrics["average_error"] == pytest.approx(sum(errors) / len(errors))
+
+
+def test_too_many_failures_raise(test_items, tmp_path):
+    tester = testing.Tester(
+        predictor(5, tmp_path, max_failure_rate=0.1),
+        test_items,
+        size=100,
+        chart=False,
+        print_interval=None,
+    )
+    with pytest.raises(RuntimeError, match="20 of 100 requests"):
+        tester.run()
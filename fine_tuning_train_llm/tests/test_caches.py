@@ -0,0 +1,67 @@
+import numpy as np
+import caches
+from caches import CurationCache, datapoint_key
+from dedup import BandTable
+from items import Item
+
+DATAPOINT = {
+    "title": "Brass Pipe Fitting",
+    "description": ["Lead free brass hex nipple"],
+    "features": ["Rated to 150 psi"],
+    "details": '{"Size": "3/4 in"}',
+}
+
+
+def curated(price):
+    item = Item.__new__(Item)
+    item.title = DATAPOINT["title"]
+    item.details = DATAPOINT["details"]
+    item.prompt = f"{Item.QUESTION}\n\nBrass Pipe Fitting\n\n{Item.PREFIX}{price:.2f}"
+    item.price = price
+    item.token_count = 170
+    item.include = True
+    return item
+
+
+def rejected():
+    item = Item.__new__(Item)
+    item.include = False
+    return item
+
+
+def test_hit_returns_the_same_item(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    keys = [datapoint_key(DATAPOINT, 12.5), datapoint_key(DATAPOINT, 99.0)]
+    CurationCache(path).put_many(keys, [curated(12.5), rejected()])
+    found = CurationCache(path).get_many(keys + [datapoint_key(DATAPOINT, 1.0)])
+    assert set(found) == set(keys)
+    assert found[keys[1]] is None
+    item, expected = found[keys[0]], curated(12.5)
+    for field in ["title", "details", "prompt", "price", "token_count", "include"]:
+        assert getattr(item, field) == getattr(expected, field)
+
+
+def test_config_change_misses(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite")
+    keys = [datapoint_key(DATAPOINT, 12.5)]
+    CurationCache(path).put_many(keys, [curated(12.5)])
+    monkeypatch.setattr(caches, "CURATION_VERSION", caches.CURATION_VERSION + 1)
+    assert CurationCache(path).get_many(keys) == {}
+    monkeypatch.undo()
+    monkeypatch.setattr(Item, "PREFIX", "Price: $")
+    assert CurationCache(path).get_many(keys) == {}
+    monkeypatch.undo()
+    assert set(CurationCache(path).get_many(keys)) == set(keys)
+
+
+def test_band_table_finds_every_key_after_growing():
+    rng = np.random.default_rng(0)
+    keys = np.unique(rng.integers(1, 2**63, size=5000, dtype=np.uint64))
+    values = np.arange(len(keys), dtype=np.uint32)
+    table = BandTable(capacity=16)
+    for i in range(0, len(keys), 700):
+        table.insert_many(keys[i : i + 700], values[i : i + 700])
+    assert len(table.keys) >= 2 * len(keys)
+    assert (table.get_many(keys) == values).all()
+    missing = np.array([2**63 + 1, 2**63 + 3], dtype=np.uint64)
+    assert (table.get_many(missing) == -1).all()
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+import fine_tunes
+from fine_tunes import FakeFineTuningClient, FineTuneJob
+
+
+@pytest.fixture
+def files(tmp_path):
+    train = tmp_path / "train.jsonl"
+    validation = tmp_path / "validation.jsonl"
+    train.write_text('{"messages": []}\n')
+    validation.write_text('{"messages": []}\n')
+    return str(train), str(validation), str(tmp_path / "state.json")
+
+
+def job(client, files, **params):
+    train, validation, state = files
+    return FineTuneJob(
+        client,
+        train,
+        validation,
+        state_path=state,
+        poll_interval=0.001,
+        max_interval=0.001,
+        model="gpt-4o-mini",
+        suffix="pricer",
+        **params,
+    )
+
+
+def test_resumes_the_same_job_after_a_restart(files, capsys):
+    client = FakeFineTuningClient(steps_per_status=3)
+    first = job(client, files)
+
+    async def interrupted():
+        # Stop the first run part way through polling, as a crash would
+        polls = 0
+        original = client.retrieve_job
+
+        def retrieve(job_id, poll=True):
+            nonlocal polls
+            polls += 1
+            if polls == 4:
+                raise KeyboardInterrupt
+            return original(job_id, poll)
+
+        client.fine_tuning.jobs.retrieve = retrieve
+        try:
+            await first.run_async()
+        finally:
+            client.fine_tuning.jobs.retrieve = original
+
+    with pytest.raises(KeyboardInterrupt):
+        asyncio.run(interrupted())
+    assert first.state["status"] == "queued"
+
+    name = job(client, files).run()
+    assert name.startswith("ft:gpt-4o-mini:personal:pricer:")
+    assert len(client.uploads) == 2
+    assert len(client.jobs) == 1
+    output = capsys.readouterr().out
+    (job_id,) = client.jobs
+    for message in ["Created fine-tuning job", "Job queued", "Job running"]:
+        assert output.count(f"{job_id} {message}\n") == 1
+
+    # A finished job is returned from the state without calling the service
+    assert job(FakeFineTuningClient(), files).run() == name
+
+
+def test_failed_job_is_not_resumed(files):
+    client = FakeFineTuningClient(steps_per_status=1, fail=True)
+    with pytest.raises(RuntimeError, match="failed"):
+        job(client, files).run()
+    retry = job(client, files)
+    assert "job_id" not in retry.state
+    assert "status" not in retry.state
+    client.fail = False
+    assert retry.run().startswith("ft:")
+    assert len(client.jobs) == 2
+    assert len(client.uploads) == 2
+
+
+def test_events_are_read_across_pages(files, monkeypatch, capsys):
+    monkeypatch.setattr(fine_tunes, "EVENTS_PAGE_SIZE", 2)
+    client = FakeFineTuningClient(steps_per_status=1)
+    fine_tune = job(client, files)
+    asyncio.run(fine_tune.upload("train_file", fine_tune.train_path))
+    asyncio.run(fine_tune.upload("validation_file", fine_tune.validation_path))
+    asyncio.run(fine_tune.create())
+    job_id = fine_tune.state["job_id"]
+    for i in range(5):
+        client.log(job_id, f"Step {i}")
+    events = asyncio.run(fine_tune.new_events())
+    assert [event.message for event in events] == ["Created fine-tuning job"] + [
+        f"Step {i}" for i in range(5)
+    ]
+    fine_tune.state["last_event_id"] = events[-1].id
+    client.log(job_id, "Step 5")
+    assert [event.message for event in asyncio.run(fine_tune.new_events())] == [
+        "Step 5"
+    ]
@@ -0,0 +1,94 @@
+import os
+import pickle
+import pytest
+from tokenizers import Tokenizer, Regex, models, pre_tokenizers, decoders, trainers
+from transformers import PreTrainedTokenizerFast
+import items
+from items import Item
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+# Llama-3's pre-tokenizer split, so offsets and pre-tokens behave as BASE_MODEL's do
+LLAMA3_PATTERN = (
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}"
+    r"| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+)
+
+
+def datapoints():
+    """
+    Raw datapoints rebuilt from the curated test items, plus one whose details have a
+    space before punctuation that clean_up_tokenization would remove
+    """
+    with open(os.path.join(DATA_DIR, "test_lite.pkl"), "rb") as file:
+        curated = pickle.load(file)[:200]
+    points = []
+    for item in curated:
+        text = item.prompt.split("\n\n", 1)[1].split(f"\n\n{Item.PREFIX}")[0]
+        body = text.split("\n", 1)[-1]
+        points.append(
+            {
+                "title": item.title,
+                "description": [body],
+                "features": [],
+                "details": item.details,
+            }
+        )
+    points.append(
+        {
+            "title": "Brass Pipe Fitting , Hex Nipple",
+            "description": ["Thread NPT # .75 inch . " + points[0]["description"][0]],
+            "features": ["Lead free brass , rated to 150 psi"],
+            "details": '{"Size": "3/4 in . NPT"}',
+        }
+    )
+    return points
+
+
+def local_tokenizer(texts, force_cleanup):
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.Sequence(
+        [
+            pre_tokenizers.Split(Regex(LLAMA3_PATTERN), behavior="isolated"),
+            pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False),
+        ]
+    )
+    bpe.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=4000,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    )
+    bpe.train_from_iterator(texts, trainer)
+    return PreTrainedTokenizerFast(
+        tokenizer_object=bpe,
+        clean_up_tokenization_spaces=True,
+        clean_up_tokenization_spaces_for_bpe_even_though_it_will_corrupt_output=(
+            force_cleanup
+        ),
+    )
+
+
+@pytest.fixture(params=[False, True], ids=["cleanup-ignored", "cleanup-applied"])
+def tokenizer(request, monkeypatch):
+    points = datapoints()
+    texts = [point["description"][0] for point in points]
+    tokenizer = local_tokenizer(texts, force_cleanup=request.param)
+    monkeypatch.setattr(items, "_tokenizers", {os.getpid(): tokenizer})
+    monkeypatch.setattr(Item, "_prefix_tokens", None)
+    monkeypatch.setattr(Item, "_decode_cleans_up", None)
+    return tokenizer
+
+
+def test_batch_matches_per_item(tokenizer):
+    points = datapoints()
+    prices = [float(10 + i) for i in range(len(points))]
+    batched = Item.batch(points, prices)
+    single = [Item(point, price) for point, price in zip(points, prices)]
+    assert sum(item.include for item in single) > 100
+    for one, other in zip(single, batched):
+        assert (one.include, one.prompt, one.token_count) == (
+            other.include,
+            other.prompt,
+            other.token_count,
+        )
@@ -0,0 +1,53 @@
+from anthropic import Anthropic
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+from responses import CachedAnthropic, CachedOpenAI, ResponseCache
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o-mini",
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "Price is $42.00"},
+        }
+    ],
+}
+
+
+def test_openai_passes_through_everything_but_create(tmp_path):
+    client = OpenAI(api_key="test")
+    cached = CachedOpenAI(client, ResponseCache(str(tmp_path / "cache.sqlite")))
+    completions = client.chat.completions
+    assert cached.chat.completions.parse == completions.parse
+    assert cached.chat.completions.stream == completions.stream
+    assert cached.chat.completions.with_raw_response is completions.with_raw_response
+    assert cached.files is client.files
+
+
+def test_openai_create_is_cached(tmp_path, monkeypatch):
+    client = OpenAI(api_key="test")
+    calls = []
+
+    def create(**params):
+        calls.append(params)
+        return ChatCompletion.model_validate(COMPLETION)
+
+    monkeypatch.setattr(client.chat.completions, "create", create)
+    cached = CachedOpenAI(client, ResponseCache(str(tmp_path / "cache.sqlite")))
+    params = {"model": "gpt-4o-mini", "messages": [], "seed": 42}
+    first = cached.chat.completions.create(**params)
+    second = cached.chat.completions.create(**params)
+    assert len(calls) == 1
+    assert second.choices[0].message.content == first.choices[0].message.content
+
+
+def test_anthropic_passes_through_everything_but_create(tmp_path):
+    client = Anthropic(api_key="test")
+    cached = CachedAnthropic(client, ResponseCache(str(tmp_path / "cache.sqlite")))
+    assert cached.messages.create == cached.create
+    assert cached.messages.stream == client.messages.stream
+    assert cached.messages.count_tokens == client.messages.count_tokens
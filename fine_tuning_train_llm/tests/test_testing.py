@@ -0,0 +1,81 @@
+import os
+import pickle
+import asyncio
+import threading
+import pytest
+import testing
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+
+@pytest.fixture
+def test_items():
+    with open(os.path.join(DATA_DIR, "test_lite.pkl"), "rb") as file:
+        return pickle.load(file)[:40]
+
+
+class BrokenOn:
+    """
+    Prices every item at $100, except the broken ones, which always raise
+    """
+
+    def __init__(self, broken):
+        self.broken = broken
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def price(self, item):
+        with self.lock:
+            self.calls += 1
+        if item.title in self.broken:
+            raise RuntimeError("model overloaded")
+        return 100.0
+
+
+def make_tester(predictor, items, **kwargs):
+    return testing.Tester(
+        predictor,
+        items,
+        size=len(items),
+        retries=2,
+        backoff=0,
+        chart=False,
+        print_interval=None,
+        **kwargs,
+    )
+
+
+def test_concurrent_run_skips_items_that_keep_failing(test_items):
+    model = BrokenOn({item.title for item in test_items[5:8]})
+
+    def predict(item):
+        return model.price(item)
+
+    run = make_tester(predict, test_items, concurrency=4)
+    run.run()
+    assert run.failed == 3
+    assert len(run.guesses) == 37
+    assert model.calls == 37 + 3 * 3
+
+
+def test_async_run_skips_items_that_keep_failing(test_items):
+    model = BrokenOn({test_items[0].title, test_items[-1].title})
+
+    async def predict(item):
+        await asyncio.sleep(0)
+        return model.price(item)
+
+    run = make_tester(predict, test_items, concurrency=4)
+    run.run()
+    assert run.failed == 2
+    assert len(run.guesses) == 38
+
+
+def test_run_raises_when_every_item_fails(test_items):
+    model = BrokenOn({item.title for item in test_items})
+
+    def predict(item):
+        return model.price(item)
+
+    with pytest.raises(RuntimeError, match="All 40 predictions failed"):
+        make_tester(predict, test_items, concurrency=4).run()
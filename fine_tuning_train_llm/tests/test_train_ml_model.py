@@ -0,0 +1,97 @@
+import os
+import pickle
+import numpy as np
+import pytest
+from gensim.utils import simple_preprocess
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.linear_model import SGDRegressor
+from sklearn.utils import murmurhash3_32
+import train_ml_model
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+
+@pytest.fixture
+def docs():
+    with open(os.path.join(DATA_DIR, "test_lite.pkl"), "rb") as file:
+        curated = pickle.load(file)[:300]
+    extra = ["", "the and of", "Café naïve_x 3D élan __init__ Ünïcödé 10mm"]
+    return [item.test_prompt() for item in curated] + extra
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """
+    A fresh set of fitted models, so a test can stand in models of its own
+    """
+    monkeypatch.setattr(train_ml_model, "fitted", {})
+    monkeypatch.setattr(train_ml_model, "indexes", {})
+    return train_ml_model.fitted
+
+
+def test_murmurhash_matches_sklearn(docs):
+    words = {word for doc in docs for word in doc.split()} | {"", "a", "ab", "abc"}
+    for word in words:
+        expected = murmurhash3_32(word, seed=0)
+        assert train_ml_model.murmurhash3_32(word.encode("utf-8")) == expected
+
+
+def test_hashed_predict_matches_hashing_vectorizer(docs, saved):
+    vectorizer = HashingVectorizer(
+        n_features=2**12, stop_words="english", alternate_sign=False
+    )
+    X = vectorizer.transform(docs)
+    regressor = SGDRegressor(random_state=42).fit(X, np.arange(len(docs)) % 7)
+    stop_words = np.array(sorted(vectorizer.get_stop_words()), dtype=str)
+    saved["sgd_bow"] = train_ml_model.linear_arrays(regressor, stop_words=stop_words)
+    predictions = train_ml_model.hashed_predict(saved["sgd_bow"], docs)
+    assert np.allclose(predictions, regressor.predict(X))
+
+
+def test_word_counts_match_count_vectorizer(docs, saved):
+    vectorizer = CountVectorizer(max_features=200, stop_words="english")
+    X = vectorizer.fit_transform(docs)
+    saved["bow_lr"] = {"vocabulary": vectorizer.get_feature_names_out().astype(str)}
+    counts = train_ml_model.word_counts(docs, "bow_lr")
+    assert (counts == X.toarray()).all()
+
+
+def test_tokens_match_gensim(docs):
+    for doc in docs:
+        assert train_ml_model.tokens(doc) == simple_preprocess(doc)
+
+
+def test_embed_averages_known_words(docs, saved, monkeypatch):
+    monkeypatch.setattr(train_ml_model, "EMBED_CHUNK", 64)
+    vocabulary = sorted({word for doc in docs[:100] for word in simple_preprocess(doc)})
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(vocabulary), 8)).astype(np.float32)
+    saved["word2vec"] = {"vocabulary": np.array(vocabulary), "vectors": vectors}
+    index = {word: i for i, word in enumerate(vocabulary)}
+    expected = np.zeros((len(docs), 8))
+    for row, doc in enumerate(docs):
+        known = [index[word] for word in simple_preprocess(doc) if word in index]
+        if known:
+            expected[row] = vectors[known].mean(axis=0)
+    assert not expected[-3].any()
+    assert np.allclose(train_ml_model.embed(docs), expected, atol=1e-5)
+
+
+def test_arrays_are_saved_as_npz_without_a_lock_file(tmp_path, saved, monkeypatch):
+    calls = []
+
+    def fit():
+        calls.append(1)
+        return {"coef": np.arange(3.0), "intercept": np.array([0.5])}
+
+    monkeypatch.setattr(train_ml_model, "MODEL_DIR", str(tmp_path))
+    monkeypatch.setitem(train_ml_model.MODELS, "toy", (fit, [], {}))
+    monkeypatch.setitem(train_ml_model.loaded, "data_hash", "test")
+    model = train_ml_model.get_model("toy")
+    path = train_ml_model.model_path("toy", "npz")
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    saved.clear()
+    reloaded = train_ml_model.get_model("toy")
+    assert len(calls) == 1
+    assert reloaded.keys() == model.keys()
+    assert train_ml_model.linear_predict(reloaded, np.ones(3)) == 3.5
@@ -1,112 +1,106 @@
 import os
-import math
+import re
 import json
+import fcntl
 import random
-from dotenv import load_dotenv
-from huggingface_hub import login
-import matplotlib.pyplot as plt
-import numpy as np
-import pickle
+import hashlib
 from collections import Counter
-
-# More imports for our traditional machine learning
-
-import pandas as pd
+from contextlib import contextmanager
+from functools import lru_cache
+from importlib.metadata import version
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.preprocessing import StandardScaler
-
-
-# NLP related imports
-
-from sklearn.feature_extraction.text import CountVectorizer
-from gensim.models import Word2Vec
-from gensim.utils import simple_preprocess
 
+# The model libraries (sklearn, gensim, scipy, hnswlib) and pandas take tenths of a
+# second to two seconds to import, so each is imported by the functions that fit or use
+# its models, and pricing with one model doesn't pay for the others. The linear models
+# are saved as numpy arrays and priced with numpy alone; the others import their own
+# modules when loaded
+
+from snapshots import PREFIX, iter_batches, load_items, snapshot_hash
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+TRAIN_PATH = "data/train_lite.arrow"
+TEST_PATH = "data/test_lite.arrow"
+MODEL_DIR = "models"
+TRAINING_THREADS = None  # cores a model may train on, None for all of them
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+NEIGHBOURS = 10
+KNN_EF = 50  # HNSW search breadth: higher is more accurate and slower
+feature_columns = ["weight", "rank", "text_length", "is_top_electronics_brand"]
+REGISTRY_VERSION = 3  # bump when a change to the feature or fit code invalidates saved models
 
-# Finally, more imports for more advanced machine learning
 
-from sklearn.svm import LinearSVR
-from sklearn.ensemble import RandomForestRegressor
+###  lazily loaded data
+# Nothing is read at import: each value is built the first time it is used, and the
+# module attributes train, test, train_df etc. still work through __getattr__
 
-from testing import Tester
+DATA = {}
+loaded = {}
 
 
-# Create a new "features" field on items, and populate it with json parsed from the details dict
+def loads(name):
+    """
+    Register the decorated function as the way to build the data value called name
+    """
 
+    def register(load):
+        DATA[name] = load
+        return load
 
-with open("data/train_lite.pkl", "rb") as file:
-    train = pickle.load(file)
+    return register
 
-with open("data/test_lite.pkl", "rb") as file:
-    test = pickle.load(file)
 
-## feature engineering functions
+def get_data(name):
+    if name not in loaded:
+        loaded[name] = DATA[name]()
+    return loaded[name]
 
-for item in train:
-    item.features = json.loads(item.details)
-for item in test:
-    item.features = json.loads(item.details)
-
-
-def get_weight(item):
-    weight_str = item.features.get("Item Weight")
-    if weight_str:
-        parts = weight_str.split(" ")
-        amount = float(parts[0])
-        unit = parts[1].lower()
-        if unit == "pounds":
-            return amount
-        elif unit == "ounces":
-            return amount / 16
-        elif unit == "grams":
-            return amount / 453.592
-        elif unit == "milligrams":
-            return amount / 453592
-        elif unit == "kilograms":
-            return amount / 0.453592
-        elif unit == "hundredths" and parts[2].lower() == "pounds":
-            return amount / 100
-        else:
-            print(weight_str)
-    return None
 
+def __getattr__(name):
+    if name in DATA:
+        return get_data(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-weights = [get_weight(t) for t in train]
-weights = [w for w in weights if w]
 
-average_weight = sum(weights) / len(weights)
-average_weight
+@loads("train")
+def load_train():
+    return load_items(TRAIN_PATH)
 
 
-def get_weight_with_default(item):
-    weight = get_weight(item)
-    return weight or average_weight
+@loads("test")
+def load_test():
+    return load_items(TEST_PATH)
 
 
-def get_rank(item):
-    rank_dict = item.features.get("Best Sellers Rank")
-    if rank_dict:
-        ranks = rank_dict.values()
-        return sum(ranks) / len(ranks)
-    return None
-
+@loads("data_hash")
+def load_data_hash():
+    """
+    Content hash of the training snapshot, which every saved model is keyed by
+    It is saved in the snapshot's metadata, so the training data isn't read to get it
+    """
+    return snapshot_hash(TRAIN_PATH)
 
-ranks = [get_rank(t) for t in train]
-ranks = [r for r in ranks if r]
-average_rank = sum(ranks) / len(ranks)
-average_rank
-
-
-def get_rank_with_default(item):
-    rank = get_rank(item)
-    return rank or average_rank
 
+## feature engineering functions
+# Features are extracted a column at a time: details are parsed from json once per item,
+# each feature is computed for a whole chunk of items, and each item's features are
+# memoised on the item so a test item priced by several pricers is only processed once
 
-def get_text_length(item):
-    return len(item.test_prompt())
+FEATURE_CHUNK = 20_000  # items per process when a feature frame is built in parallel
 
+WEIGHT_UNITS = {
+    "pounds": 1,
+    "ounces": 16,
+    "grams": 453.592,
+    "milligrams": 453592,
+    "kilograms": 0.453592,
+    "hundredths pounds": 100,
+}
 
 TOP_ELECTRONICS_BRANDS = [
     "hp",
@@ -121,32 +115,318 @@ TOP_ELECTRONICS_BRANDS = [
 ]
 
 
-def is_top_electronics_brand(item):
-    brand = item.features.get("Brand")
-    return brand and brand.lower() in TOP_ELECTRONICS_BRANDS
+def convert_weight(weight_str):
+    """
+    A weight like "1.5 Pounds" in pounds, or NaN if it is in a unit we don't know
+    """
+    amount, unit, *rest = weight_str.lower().split(" ")
+    if unit == "hundredths" and rest:
+        unit = f"{unit} {rest[0]}"
+    divisor = WEIGHT_UNITS.get(unit)
+    if divisor is None:
+        print(weight_str)
+        return np.nan
+    return float(amount) / divisor
+
+
+def get_weights(features):
+    """
+    Item weights in pounds, NaN where missing or in a unit we don't know
+    """
+    weight_strs = [f.get("Item Weight") for f in features]
+    return np.array(
+        [convert_weight(w) if w else np.nan for w in weight_strs], dtype=float
+    )
+
+
+def get_ranks(features):
+    """
+    The average of each item's Best Sellers ranks, NaN if it has none
+    """
+    ranks = [f.get("Best Sellers Rank") for f in features]
+    return np.array(
+        [sum(r.values()) / len(r) if r else np.nan for r in ranks], dtype=float
+    )
+
+
+def get_text_lengths(prompts):
+    """
+    The length of each item's test prompt, i.e. the prompt up to and including the prefix
+    """
+    ends = np.array([prompt.find(PREFIX) for prompt in prompts], dtype=int)
+    lengths = np.array([len(prompt) for prompt in prompts], dtype=int)
+    return np.where(ends >= 0, ends, lengths) + len(PREFIX)
+
+
+def are_top_electronics_brands(features):
+    import pandas as pd
+
+    brands = pd.Series([f.get("Brand") for f in features], dtype=object)
+    return brands.str.lower().isin(TOP_ELECTRONICS_BRANDS).astype(int).to_numpy()
+
+
+def raw_features(details, prompts):
+    """
+    The feature columns for the given details and prompts, with a missing (or zero) weight
+    or rank left as NaN
+    """
+    import pandas as pd
+
+    features = [json_loads(d) for d in details]
+    frame = pd.DataFrame(
+        {
+            "weight": get_weights(features),
+            "rank": get_ranks(features),
+            "text_length": get_text_lengths(prompts),
+            "is_top_electronics_brand": are_top_electronics_brands(features),
+        }
+    )
+    return frame.replace({"weight": {0: np.nan}, "rank": {0: np.nan}})
+
+
+def raw_feature_frame(items, workers=None):
+    """
+    The raw features of the items, memoised on each item as its feature_row, and computed
+    in parallel chunks when more than FEATURE_CHUNK items haven't been seen before
+    """
+    import pandas as pd
+
+    missing = [item for item in items if getattr(item, "feature_row", None) is None]
+    chunks = [
+        missing[i : i + FEATURE_CHUNK] for i in range(0, len(missing), FEATURE_CHUNK)
+    ]
+    details = [[item.details for item in chunk] for chunk in chunks]
+    prompts = [[item.prompt for item in chunk] for chunk in chunks]
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers or TRAINING_THREADS) as pool:
+            frames = list(pool.map(raw_features, details, prompts))
+    else:
+        frames = list(map(raw_features, details, prompts))
+    for chunk, frame in zip(chunks, frames):
+        for item, row in zip(chunk, frame.itertuples(index=False, name=None)):
+            item.feature_row = row
+    return pd.DataFrame([item.feature_row for item in items], columns=feature_columns)
+
+
+def feature_frame(items, workers=None):
+    """
+    The features of the items, with the training set averages standing in for a missing
+    weight or rank
+    """
+    return raw_feature_frame(items, workers).fillna(feature_defaults())
 
 
 def get_features(item):
-    return {
-        "weight": get_weight_with_default(item),
-        "rank": get_rank_with_default(item),
-        "text_length": get_text_length(item),
-        "is_top_electronics_brand": 1 if is_top_electronics_brand(item) else 0,
-    }
+    return feature_frame([item]).to_dict("records")[0]
 
 
 # A utility function to convert our features into a pandas dataframe
 
 
 def list_to_dataframe(items):
-    features = [get_features(item) for item in items]
-    df = pd.DataFrame(features)
+    df = feature_frame(items)
     df["price"] = [item.price for item in items]
     return df
 
 
-train_df = list_to_dataframe(train)
-test_df = list_to_dataframe(test[:250])
+@loads("train_df")
+def load_train_df():
+    df = get_model("train_features").fillna(feature_defaults())
+    df["price"] = get_data("prices")
+    return df
+
+
+@loads("test_df")
+def load_test_df():
+    return list_to_dataframe(get_data("test")[:250])
+
+
+###  model registry
+# Models are fitted lazily, the first time a pricer needs them, and saved under MODEL_DIR
+# keyed by a hash of the training data, the hyperparameters and the models they are fitted
+# from; later runs load them from there instead of fitting them again
+
+MODELS = {}
+fitted = {}
+
+
+def fits(name, needs=(), **params):
+    """
+    Register the decorated function as the way to fit the model called name
+    It is called with params as keyword arguments, and can use get_model on the models it needs
+    """
+
+    def register(fit):
+        MODELS[name] = (fit, list(needs), params)
+        return fit
+
+    return register
+
+
+def model_key(name):
+    """
+    Hash of everything a fitted model depends on, including the versions of the libraries
+    that will unpickle it
+    """
+    _, needs, params = MODELS[name]
+    key = {
+        "registry": REGISTRY_VERSION,
+        "name": name,
+        "data": get_data("data_hash"),
+        "params": params,
+        "needs": [model_key(need) for need in needs],
+        "libraries": [version("numpy"), version("scikit-learn"), version("gensim")],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def model_path(name, extension="joblib"):
+    return os.path.join(MODEL_DIR, f"{name}-{model_key(name)}.{extension}")
+
+
+def is_arrays(model):
+    """
+    Whether a model is a dict of numpy arrays that np.load can read without pickle
+    """
+    return isinstance(model, dict) and all(
+        isinstance(value, np.ndarray) and value.dtype != object
+        for value in model.values()
+    )
+
+
+def load_model(name):
+    """
+    The model saved under its current key, or None if there isn't one
+    A model saved as arrays is read with numpy alone, anything else with joblib
+    """
+    path = model_path(name, "npz")
+    if os.path.exists(path):
+        with np.load(path) as arrays:
+            return dict(arrays)
+    path = model_path(name)
+    if os.path.exists(path):
+        import joblib
+
+        return joblib.load(path)
+    return None
+
+
+def save_model(name, model):
+    """
+    Save a model that is a dict of numpy arrays as an npz file, anything else with
+    joblib
+    """
+    partial = os.path.join(MODEL_DIR, f"{name}.{os.getpid()}.partial")
+    if is_arrays(model):
+        path = model_path(name, "npz")
+        with open(partial, "wb") as file:
+            np.savez(file, **model)
+    else:
+        import joblib
+
+        path = model_path(name)
+        joblib.dump(model, partial)
+    os.replace(partial, path)
+
+
+@contextmanager
+def fit_lock(name):
+    """
+    Hold an exclusive lock on fitting the named model, across processes
+    The lock file is removed once the fit is saved; a process that was waiting on the
+    removed file finds it gone and locks the new one instead
+    """
+    path = model_path(name, "lock")
+    while True:
+        lock = open(path, "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(lock.fileno()), os.stat(path)):
+                break
+        except FileNotFoundError:
+            pass
+        lock.close()
+    try:
+        yield
+    finally:
+        os.remove(path)
+        lock.close()
+
+
+def get_model(name):
+    """
+    Return the fitted model, loading it from MODEL_DIR if it was saved under its current key,
+    otherwise fitting it and saving it there
+    """
+    if name not in fitted:
+        model = load_model(name)
+        if model is None:
+            os.makedirs(MODEL_DIR, exist_ok=True)
+            # Only one process fits each model; the others wait for it and load what
+            # it saved. Fits like Word2Vec aren't deterministic, so a model fitted
+            # separately in two leaderboard workers wouldn't match the models saved
+            # downstream of it
+            with fit_lock(name):
+                model = load_model(name)
+                if model is None:
+                    fit, _, params = MODELS[name]
+                    model = fit(**params)
+                    save_model(name, model)
+        fitted[name] = model
+    return fitted[name]
+
+
+indexes = {}
+
+
+def index_of(name, key="vocabulary"):
+    """
+    word -> position in one of the word arrays of a saved model, built once per process
+    """
+    if (name, key) not in indexes:
+        words = get_model(name)[key].tolist()
+        indexes[name, key] = {word: i for i, word in enumerate(words)}
+    return indexes[name, key]
+
+
+def linear_arrays(regressor, **arrays):
+    """
+    A fitted sklearn linear model as the arrays its predictions need, plus any others
+    the pricer needs, so pricing with it is a dot product that doesn't import sklearn
+    """
+    return {
+        "coef": np.ravel(regressor.coef_).astype(float),
+        "intercept": np.atleast_1d(regressor.intercept_).astype(float),
+        **arrays,
+    }
+
+
+def linear_predict(model, x):
+    return x @ model["coef"] + model["intercept"][0]
+
+
+# The features of the training set, and the averages that stand in for a missing weight
+# or rank, are saved like any model: refitting with other hyperparameters reuses them, and
+# pricing an item doesn't need the training set to be loaded
+
+
+@fits("train_features")
+def fit_train_features():
+    return raw_feature_frame(get_data("train"))
+
+
+@fits("feature_defaults", needs=["train_features"])
+def fit_feature_defaults():
+    train_features = get_model("train_features")
+    return {
+        "weight": np.array(train_features["weight"].mean()),
+        "rank": np.array(train_features["rank"].mean()),
+    }
+
+
+def feature_defaults():
+    defaults = get_model("feature_defaults")
+    return {column: float(value) for column, value in defaults.items()}
 
 
 ###  model 1
@@ -158,136 +438,553 @@ def random_pricer(item):
 ### linnear regression model
 
 
-np.random.seed(42)
+@fits("linear_regression", needs=["feature_defaults"], columns=feature_columns)
+def fit_linear_regression(columns):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import mean_squared_error, r2_score
 
-# Separate features and target
-feature_columns = ["weight", "rank", "text_length", "is_top_electronics_brand"]
+    np.random.seed(42)
 
-X_train = train_df[feature_columns]
-y_train = train_df["price"]
-X_test = test_df[feature_columns]
-y_test = test_df["price"]
+    train_df = get_data("train_df")
+    test_df = get_data("test_df")
+    X_train = train_df[columns]
+    y_train = train_df["price"]
+    X_test = test_df[columns]
+    y_test = test_df["price"]
 
-# Train a Linear Regression
-model = LinearRegression()
-model.fit(X_train, y_train)
+    # Train a Linear Regression
+    model = LinearRegression()
+    model.fit(X_train, y_train)
 
-for feature, coef in zip(feature_columns, model.coef_):
-    print(f"{feature}: {coef}")
-print(f"Intercept: {model.intercept_}")
+    for feature, coef in zip(columns, model.coef_):
+        print(f"{feature}: {coef}")
+    print(f"Intercept: {model.intercept_}")
 
-# Predict the test set and evaluate
-y_pred = model.predict(X_test)
-mse = mean_squared_error(y_test, y_pred)
-r2 = r2_score(y_test, y_pred)
+    # Predict the test set and evaluate
+    y_pred = model.predict(X_test)
+    mse = mean_squared_error(y_test, y_pred)
+    r2 = r2_score(y_test, y_pred)
 
-print(f"Mean Squared Error: {mse}")
-print(f"R-squared Score: {r2}")
+    print(f"Mean Squared Error: {mse}")
+    print(f"R-squared Score: {r2}")
+    return linear_arrays(model)
 
 
 def linear_regression_pricer(item):
-    features = get_features(item)
-    features_df = pd.DataFrame([features])
-    return model.predict(features_df)[0]
+    return linear_regression_pricer_batch([item])[0]
+
+
+def linear_regression_pricer_batch(items):
+    features = feature_frame(items)[feature_columns].to_numpy()
+    return linear_predict(get_model("linear_regression"), features)
+
+
+linear_regression_pricer.predict_batch = linear_regression_pricer_batch
 
 
 ###
 # For the next few models, we prepare our documents and prices
 # Note that we use the test prompt for the documents, otherwise we'll reveal the answer!!
 
-prices = np.array([float(item.price) for item in train])
-documents = [item.test_prompt() for item in train]
 
-# Use the CountVectorizer for a Bag of Words model
 
-np.random.seed(42)
-vectorizer = CountVectorizer(max_features=1000, stop_words="english")
-X = vectorizer.fit_transform(documents)
-regressor = LinearRegression()
-regressor.fit(X, prices)
+@loads("prices")
+def load_prices():
+    return np.array([float(item.price) for item in get_data("train")])
+
+
+@loads("documents")
+def load_documents():
+    return [item.test_prompt() for item in get_data("train")]
+
+
+# Use the CountVectorizer for a Bag of Words model. Only its vocabulary is saved, and
+# documents are counted over it as CountVectorizer would: the lowercased words of two or
+# more word characters. Stop words are never in the vocabulary, so they drop out with
+# every other word it doesn't have
+
+WORD_PATTERN = re.compile(r"(?u)\b\w\w+\b")  # CountVectorizer's default token_pattern
+
+
+def word_counts(docs, name):
+    """
+    Bag of Words counts of the docs over the vocabulary of the named model
+    """
+    index = index_of(name)
+    counts = np.zeros((len(docs), len(index)))
+    for row, doc in enumerate(docs):
+        for word in WORD_PATTERN.findall(doc.lower()):
+            column = index.get(word)
+            if column is not None:
+                counts[row, column] += 1
+    return counts
+
+
+@fits("bow_lr", max_features=1000, stop_words="english")
+def fit_bow_lr(max_features, stop_words):
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.linear_model import LinearRegression
+
+    np.random.seed(42)
+    vectorizer = CountVectorizer(max_features=max_features, stop_words=stop_words)
+    X = vectorizer.fit_transform(get_data("documents"))
+    regressor = LinearRegression()
+    regressor.fit(X, get_data("prices"))
+    vocabulary = vectorizer.get_feature_names_out().astype(str)
+    return linear_arrays(regressor, vocabulary=vocabulary)
 
 
 def bow_lr_pricer(item):
-    x = vectorizer.transform([item.test_prompt()])
-    return max(regressor.predict(x)[0], 0)
+    return bow_lr_pricer_batch([item])[0]
+
+
+def bow_lr_pricer_batch(items):
+    counts = word_counts([item.test_prompt() for item in items], "bow_lr")
+    return np.maximum(linear_predict(get_model("bow_lr"), counts), 0)
+
+
+bow_lr_pricer.predict_batch = bow_lr_pricer_batch
+
+
+# An out-of-core Bag of Words model for training sets too large to hold in memory:
+# the hashing vectorizer needs no vocabulary pass, and the SGD regressor is updated one
+# batch of the snapshot at a time. It predicts log prices, which keeps the gradient steps
+# stable across the wide range of prices. The stop words are saved with it, and
+# documents are hashed as HashingVectorizer does, with MurmurHash3 into l2-normalised
+# counts
+
+
+def murmurhash3_32(data, seed=0):
+    """
+    MurmurHash3 x86 32-bit of some bytes as a signed int, as sklearn's hashing uses it
+    """
+    h = seed
+    end = len(data) & ~3
+    for block in range(0, end, 4):
+        h ^= mix(int.from_bytes(data[block : block + 4], "little"))
+        h = ((h << 13) | (h >> 19)) & 0xFFFFFFFF
+        h = (h * 5 + 0xE6546B64) & 0xFFFFFFFF
+    if end < len(data):
+        h ^= mix(int.from_bytes(data[end:], "little"))
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+def mix(k):
+    k = (k * 0xCC9E2D51) & 0xFFFFFFFF
+    k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+    return (k * 0x1B873593) & 0xFFFFFFFF
+
+
+@lru_cache(maxsize=100_000)
+def hashed_column(word, n_features):
+    h = murmurhash3_32(word.encode("utf-8"))
+    if h == -(2**31):
+        return (2**31 - 1 - (n_features - 1)) % n_features
+    return abs(h) % n_features
+
+
+def hashed_predict(model, docs):
+    """
+    The linear model's predictions on the HashingVectorizer features of the docs, taken
+    from the columns each document's words hash to, without building the feature matrix
+    """
+    coef = model["coef"]
+    stop_words = index_of("sgd_bow", "stop_words")
+    predictions = np.zeros(len(docs))
+    for row, doc in enumerate(docs):
+        counts = Counter(
+            hashed_column(word, len(coef))
+            for word in WORD_PATTERN.findall(doc.lower())
+            if word not in stop_words
+        )
+        if counts:
+            values = np.fromiter(counts.values(), dtype=float, count=len(counts))
+            columns = np.fromiter(counts, dtype=np.int64, count=len(counts))
+            predictions[row] = values @ coef[columns] / np.sqrt(values @ values)
+    return predictions + model["intercept"][0]
+
+
+def test_prompts(prompts):
+    return [prompt.split(PREFIX)[0] + PREFIX for prompt in prompts]
+
+
+@fits(
+    "sgd_bow",
+    n_features=2**20,
+    stop_words="english",
+    alpha=1e-6,
+    eta0=0.1,
+    epochs=5,
+    batch_size=10_000,
+)
+def fit_sgd_bow(n_features, stop_words, alpha, eta0, epochs, batch_size):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import SGDRegressor
+
+    vectorizer = HashingVectorizer(
+        n_features=n_features, stop_words=stop_words, alternate_sign=False
+    )
+    regressor = SGDRegressor(alpha=alpha, eta0=eta0, random_state=42)
+    for _ in range(epochs):
+        for batch in iter_batches(TRAIN_PATH, ["prompt", "price"], batch_size):
+            X = vectorizer.transform(test_prompts(batch["prompt"]))
+            regressor.partial_fit(X, np.log1p(batch["price"]))
+    stop_words = sorted(vectorizer.get_stop_words() or [])
+    return linear_arrays(regressor, stop_words=np.array(stop_words, dtype=str))
+
+
+def sgd_bow_pricer(item):
+    return sgd_bow_pricer_batch([item])[0]
+
+
+def sgd_bow_pricer_batch(items):
+    docs = [item.test_prompt() for item in items]
+    return np.maximum(np.expm1(hashed_predict(get_model("sgd_bow"), docs)), 0)
+
+
+sgd_bow_pricer.predict_batch = sgd_bow_pricer_batch
 
 
 ###  word2vec model, implemented in gensim NLP library
+# Only the vocabulary and the word vectors are saved, and documents are tokenised as
+# gensim's simple_preprocess does, so embedding a document doesn't import gensim
 
-np.random.seed(42)
+GENSIM_WORD = re.compile(r"((?!\d)\w)+")
+EMBED_CHUNK = 256  # documents whose word vectors are gathered at once
 
-# Preprocess the documents
-processed_docs = [simple_preprocess(doc) for doc in documents]
 
-# Train Word2Vec model
-w2v_model = Word2Vec(
-    sentences=processed_docs, vector_size=400, window=5, min_count=1, workers=8
-)
+@fits("word2vec", vector_size=400, window=5, min_count=1)
+def fit_word2vec(vector_size, window, min_count):
+    from gensim.models import Word2Vec
 
+    np.random.seed(42)
 
-def document_vector(doc):
-    doc_words = simple_preprocess(doc)
-    word_vectors = [w2v_model.wv[word] for word in doc_words if word in w2v_model.wv]
-    return (
-        np.mean(word_vectors, axis=0)
-        if word_vectors
-        else np.zeros(w2v_model.vector_size)
+    # Preprocess the documents
+    processed_docs = [tokens(doc) for doc in get_data("documents")]
+
+    # Train Word2Vec model
+    model = Word2Vec(
+        sentences=processed_docs,
+        vector_size=vector_size,
+        window=window,
+        min_count=min_count,
+        workers=TRAINING_THREADS or 8,
     )
+    return {
+        "vocabulary": np.array(model.wv.index_to_key, dtype=str),
+        "vectors": model.wv.vectors,
+    }
+
+
+@lru_cache(maxsize=100_000)
+def tokens(doc):
+    """
+    The words of a document as word2vec sees them, cached so the training documents are
+    tokenised once for fitting and embedding, and repeated test items aren't tokenised again
+    The same words as gensim's simple_preprocess: runs of letters, lowercased, of 2 to
+    15 characters and not starting with an underscore
+    """
+    return [
+        word
+        for word in (match.group() for match in GENSIM_WORD.finditer(doc.lower()))
+        if 2 <= len(word) <= 15 and not word.startswith("_")
+    ]
+
+
+def embed(docs):
+    """
+    Mean word2vec vector of each document, EMBED_CHUNK documents at a time
+    The vectors of a chunk's known words are gathered, weighted by 1/n for a document of
+    n known words, and summed per document with np.add.reduceat; a document with no
+    known words gets zeros
+    """
+    vectors = get_model("word2vec")["vectors"]
+    index = index_of("word2vec")
+    embedded = np.zeros((len(docs), vectors.shape[1]), dtype=vectors.dtype)
+    for start in range(0, len(docs), EMBED_CHUNK):
+        rows = [
+            [index[w] for w in tokens(doc) if w in index]
+            for doc in docs[start : start + EMBED_CHUNK]
+        ]
+        lengths = np.array([len(row) for row in rows])
+        if not lengths.any():
+            continue
+        indices = np.fromiter((i for row in rows for i in row), dtype=np.int64)
+        weights = np.repeat(1 / np.maximum(lengths, 1), lengths).astype(vectors.dtype)
+        found = np.flatnonzero(lengths)
+        offsets = (np.cumsum(lengths) - lengths)[found]
+        embedded[start + found] = np.add.reduceat(
+            vectors[indices] * weights[:, None], offsets
+        )
+    return embedded
+
+
+def document_vector(doc):
+    return embed([doc])[0]
 
 
 # Create feature matrix
-X_w2v = np.array([document_vector(doc) for doc in documents])
+@fits("word2vec_features", needs=["word2vec"])
+def fit_word2vec_features():
+    return embed(get_data("documents"))
+
+
 # Run Linear Regression on word2vec
 
-word2vec_lr_regressor = LinearRegression()
-word2vec_lr_regressor.fit(X_w2v, prices)
+
+@fits("word2vec_lr", needs=["word2vec_features"])
+def fit_word2vec_lr():
+    from sklearn.linear_model import LinearRegression
+
+    word2vec_lr_regressor = LinearRegression()
+    word2vec_lr_regressor.fit(get_model("word2vec_features"), get_data("prices"))
+    return linear_arrays(word2vec_lr_regressor)
 
 
 def word2vec_lr_pricer(item):
     doc = item.test_prompt()
     doc_vector = document_vector(doc)
-    return max(0, word2vec_lr_regressor.predict([doc_vector])[0])
+    return max(0, linear_predict(get_model("word2vec_lr"), doc_vector))
+
+
+def document_vectors(items):
+    return embed([item.test_prompt() for item in items])
+
+
+def word2vec_lr_pricer_batch(items):
+    vectors = document_vectors(items)
+    return np.maximum(linear_predict(get_model("word2vec_lr"), vectors), 0)
+
+
+word2vec_lr_pricer.predict_batch = word2vec_lr_pricer_batch
 
 
 # Support Vector Machines
 
-np.random.seed(42)
-svr_regressor = LinearSVR()
 
-svr_regressor.fit(X_w2v, prices)
+@fits("svr", needs=["word2vec_features"])
+def fit_svr():
+    from sklearn.svm import LinearSVR
+
+    np.random.seed(42)
+    svr_regressor = LinearSVR()
+    svr_regressor.fit(get_model("word2vec_features"), get_data("prices"))
+    return linear_arrays(svr_regressor)
 
 
 def svr_pricer(item):
     np.random.seed(42)
     doc = item.test_prompt()
     doc_vector = document_vector(doc)
-    return max(float(svr_regressor.predict([doc_vector])[0]), 0)
+    return max(float(linear_predict(get_model("svr"), doc_vector)), 0)
+
+
+def svr_pricer_batch(items):
+    return np.maximum(linear_predict(get_model("svr"), document_vectors(items)), 0)
+
+
+svr_pricer.predict_batch = svr_pricer_batch
 
 
 # And the powerful Random Forest regression
 
-rf_model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=8)
-rf_model.fit(X_w2v, prices)
+
+@fits("random_forest", needs=["word2vec_features"], n_estimators=100, random_state=42)
+def fit_random_forest(n_estimators, random_state):
+    from sklearn.ensemble import RandomForestRegressor
+
+    rf_model = RandomForestRegressor(
+        n_estimators=n_estimators,
+        random_state=random_state,
+        n_jobs=TRAINING_THREADS or -1,
+    )
+    rf_model.fit(get_model("word2vec_features"), get_data("prices"))
+    return rf_model
 
 
 def random_forest_pricer(item):
     doc = item.test_prompt()
     doc_vector = document_vector(doc)
-    return max(0, rf_model.predict([doc_vector])[0])
+    return max(0, get_model("random_forest").predict([doc_vector])[0])
 
 
-if __name__ == "__main__":
+def random_forest_pricer_batch(items):
+    return np.maximum(get_model("random_forest").predict(document_vectors(items)), 0)
 
-    # # Run our TestRunner
-    # random.seed(42)
-    # Tester.test(random_pricer, test)
 
-    # Tester.test(linear_regression_pricer, test)
+random_forest_pricer.predict_batch = random_forest_pricer_batch
 
-    Tester.test(bow_lr_pricer, test)
 
-    # Tester.test(word2vec_lr_pricer, test)
+# Histogram gradient boosting on Bag of Words counts next to the engineered features.
+# It needs a dense matrix, so the training rows are subsampled to fit within memory_mb,
+# the trees are grown on at most TRAINING_THREADS cores, and boosting stops early once
+# a held-out tenth of the training set stops improving
 
-    # Tester.test(svr_pricer, test)
 
-    # Tester.test(random_forest_pricer, test)
+def boosting_matrix(counts, features):
+    """
+    Sparse Bag of Words counts and a frame of engineered features as one dense matrix
+    """
+    import scipy.sparse as sp
+
+    matrix = sp.hstack([counts, features.to_numpy()], format="csr")
+    return matrix.astype(np.float32).toarray()
+
+
+@fits(
+    "gradient_boosting",
+    needs=["feature_defaults"],
+    max_features=1000,
+    learning_rate=0.1,
+    max_leaf_nodes=31,
+    max_iter=1000,
+    n_iter_no_change=20,
+    memory_mb=1024,
+)
+def fit_gradient_boosting(
+    max_features, learning_rate, max_leaf_nodes, max_iter, n_iter_no_change, memory_mb
+):
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    from sklearn.feature_extraction.text import CountVectorizer
+    from threadpoolctl import threadpool_limits
+
+    vectorizer = CountVectorizer(max_features=max_features, stop_words="english")
+    counts = vectorizer.fit_transform(get_data("documents"))
+    features = get_data("train_df")[feature_columns]
+    prices = get_data("prices")
+    max_rows = memory_mb * 2**20 // (4 * (counts.shape[1] + len(feature_columns)))
+    if len(prices) > max_rows:
+        print(f"Training gradient boosting on {max_rows:,} of {len(prices):,} items")
+        rows = np.sort(
+            np.random.default_rng(42).choice(len(prices), max_rows, replace=False)
+        )
+        counts, features, prices = counts[rows], features.iloc[rows], prices[rows]
+    regressor = HistGradientBoostingRegressor(
+        learning_rate=learning_rate,
+        max_leaf_nodes=max_leaf_nodes,
+        max_iter=max_iter,
+        early_stopping=True,
+        n_iter_no_change=n_iter_no_change,
+        random_state=42,
+    )
+    with threadpool_limits(limits=TRAINING_THREADS):
+        regressor.fit(boosting_matrix(counts, features), np.log1p(prices))
+    return vectorizer, regressor
+
+
+def gradient_boosting_pricer(item):
+    return gradient_boosting_pricer_batch([item])[0]
+
+
+def gradient_boosting_pricer_batch(items):
+    vectorizer, regressor = get_model("gradient_boosting")
+    counts = vectorizer.transform([item.test_prompt() for item in items])
+    x = boosting_matrix(counts, feature_frame(items))
+    return np.maximum(np.expm1(regressor.predict(x)), 0)
+
+
+gradient_boosting_pricer.predict_batch = gradient_boosting_pricer_batch
+
+
+# Nearest neighbours: the training items are embedded with the same sentence transformer
+# as agentic_ai_flow/rag.py and indexed with HNSW, and an item is priced at the
+# distance-weighted median price of its most similar training items. No network calls
+# are needed once the encoder has been downloaded
+
+
+@loads("encoder")
+def load_encoder():
+    # sentence_transformers imports torch, which takes seconds, so it is only imported
+    # when an embedding pricer is used
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def description(prompt):
+    text = prompt.replace("How much does this cost to the nearest dollar?\n\n", "")
+    return text.split("\n\n" + PREFIX)[0]
+
+
+def encode(prompts):
+    return get_data("encoder").encode(
+        [description(prompt) for prompt in prompts],
+        batch_size=64,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+
+
+@fits("knn", embedding_model=EMBEDDING_MODEL, M=16, ef_construction=200)
+def fit_knn(embedding_model, M, ef_construction):
+    import hnswlib
+
+    vectors = encode(get_data("documents"))
+    index = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+    index.init_index(
+        max_elements=len(vectors), M=M, ef_construction=ef_construction, random_seed=42
+    )
+    index.add_items(vectors, num_threads=TRAINING_THREADS or -1)
+    return index, get_data("prices")
+
+
+def weighted_medians(values, weights):
+    """
+    The weighted median of each row of values
+    """
+    order = np.argsort(values, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    totals = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+    middle = (totals < totals[:, -1:] / 2).sum(axis=1)
+    return values[np.arange(len(values)), middle]
+
+
+def knn_pricer(item):
+    return knn_pricer_batch([item])[0]
+
+
+def knn_pricer_batch(items):
+    index, train_prices = get_model("knn")
+    index.set_ef(max(KNN_EF, NEIGHBOURS))
+    labels, distances = index.knn_query(
+        encode([item.prompt for item in items]), k=NEIGHBOURS
+    )
+    return weighted_medians(train_prices[labels], 1 / (distances + 1e-6))
+
+
+knn_pricer.predict_batch = knn_pricer_batch
+
+
+# Every pricer the leaderboard can run, with the models it needs fitted first
+
+PRICERS = {
+    "random_pricer": (random_pricer, []),
+    "linear_regression_pricer": (
+        linear_regression_pricer,
+        ["feature_defaults", "linear_regression"],
+    ),
+    "bow_lr_pricer": (bow_lr_pricer, ["bow_lr"]),
+    "sgd_bow_pricer": (sgd_bow_pricer, ["sgd_bow"]),
+    "word2vec_lr_pricer": (word2vec_lr_pricer, ["word2vec", "word2vec_lr"]),
+    "svr_pricer": (svr_pricer, ["word2vec", "svr"]),
+    "random_forest_pricer": (random_forest_pricer, ["word2vec", "random_forest"]),
+    "gradient_boosting_pricer": (
+        gradient_boosting_pricer,
+        ["feature_defaults", "gradient_boosting"],
+    ),
+    "knn_pricer": (knn_pricer, ["knn"]),
+}
+
+
+if __name__ == "__main__":
+    from leaderboard import run_leaderboard
+
+    # Fit and score every registered pricer on the same test slice, one process each
+    random.seed(42)
+    run_leaderboard(list(PRICERS), size=250)